@@ -0,0 +1,168 @@
+'''
+Opt-in instrumentation for the batch tools.
+
+A BatchStats collects cumulative time per stage (roster parsing, template copy, jsonpath, email hashing,
+validation, writes...), a histogram of per-row instantiation latency, throughput and peak RSS. The instantiate
+loops call a NullStats with empty methods when instrumentation is off, which costs well under a microsecond
+per row.
+Stats from worker processes are sent back as dicts and merged into the parent's.
+'''
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# bucket i counts rows that took less than 2**i microseconds; the last bucket is open-ended
+HISTOGRAM_BUCKETS = 28
+
+
+def peak_rss(who='self'):
+    """Peak resident set size in bytes of this process ('self') or of its finished children ('children')"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+class BatchStats:
+    def __init__(self):
+        self.stages = {}
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.last = self.started
+        self.row_started = self.started
+
+    def start_row(self):
+        """Start timing a row; the time until the next lap is charged to that lap's stage"""
+        self.last = self.row_started = time.perf_counter()
+
+    def mark(self):
+        """Start timing a stage outside of a row, e.g. a write"""
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        """Charge the time since the previous lap (or the start of the row) to STAGE"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def end_row(self):
+        """Record the latency of the current row, from start_row to now"""
+        micros = int((time.perf_counter() - self.row_started) * 1e6)
+        self.histogram[min(micros.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.rows += 1
+
+    def timed_iter(self, stage, iterable):
+        """Yield the items of ITERABLE, charging the time spent producing them to STAGE"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - start)
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def merge(self, other):
+        """Add the stage times, rows and histogram of OTHER, a dict from to_dict, e.g. sent by a worker"""
+        for stage, seconds in other['stages'].items():
+            self.add(stage, seconds)
+        for bucket, count in enumerate(other['histogram']):
+            self.histogram[bucket] += count
+        self.rows += other['rows']
+
+    def percentile(self, fraction):
+        """Upper bound in microseconds of the histogram bucket holding the FRACTION quantile of row latency"""
+        if not self.rows:
+            return None
+        threshold = fraction * self.rows
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= threshold:
+                return 1 << bucket
+        return 1 << (HISTOGRAM_BUCKETS - 1)
+
+    def to_dict(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        return {
+            'rows': self.rows,
+            'elapsed_seconds': elapsed,
+            'rows_per_second': self.rows / elapsed if elapsed else None,
+            'stages': dict(self.stages),
+            'histogram': list(self.histogram),
+            'latency_us': {
+                'p50': self.percentile(0.5),
+                'p90': self.percentile(0.9),
+                'p99': self.percentile(0.99),
+            },
+            'peak_rss_bytes': peak_rss(),
+            'peak_rss_children_bytes': peak_rss('children'),
+        }
+
+    def summary(self):
+        stats = self.to_dict()
+        lines = ['Instantiated {0} rows in {1:.2f}s ({2:.1f} rows/s)'.format(
+            stats['rows'], stats['elapsed_seconds'], stats['rows_per_second'] or 0)]
+        total = sum(self.stages.values())
+        for stage, seconds in sorted(self.stages.items(), key=lambda item: -item[1]):
+            lines.append('  {0:<14} {1:10.3f}s {2:6.1f}%'.format(stage, seconds, 100 * seconds / total if total else 0))
+        if stats['rows']:
+            lines.append('  row latency    p50 < {p50}us, p90 < {p90}us, p99 < {p99}us'.format(**stats['latency_us']))
+        if stats['peak_rss_bytes'] is not None:
+            lines.append('  peak RSS       {0:.1f} MiB (workers {1:.1f} MiB)'.format(
+                stats['peak_rss_bytes'] / float(1 << 20), stats['peak_rss_children_bytes'] / float(1 << 20)))
+        return '\n'.join(lines)
+
+    def report(self, stats_file=None):
+        """Print the summary, or write the stats as JSON to STATS_FILE"""
+        self.finish()
+        if stats_file:
+            with open(stats_file, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2)
+        else:
+            print(self.summary())
+
+
+class NullStats:
+    """Stands in for a BatchStats when instrumentation is off"""
+    def start_row(self):
+        pass
+
+    def mark(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def end_row(self):
+        pass
+
+    def timed_iter(self, stage, iterable):
+        return iterable
+
+
+NULL_STATS = NullStats()
+
+
+def get_batch_stats(config):
+    """Return a BatchStats if the stats or stats_file options are set, otherwise None"""
+    if config.stats or config.stats_file:
+        return BatchStats()
+    return None
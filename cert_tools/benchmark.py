@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks for the template and instantiate tools.
+
+Generates synthetic rosters and templates (with small or large embedded images) in a temporary directory, times
+the hot paths of the v1.2, v2 and v3 tools and writes the results as JSON, so that runs can be compared and
+regressions show up before they reach production:
+
+    python -m cert_tools.benchmark --sizes 1000 100000 --output_file benchmark.json
+
+Benchmarks that can't run in the current environment (e.g. schema validation without network access to the
+referenced schemas) are reported with an error instead of a timing.
+'''
+import argparse
+import collections
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import configargparse
+
+from cert_tools import __version__
+from cert_tools import create_v1_2_certificate_template
+from cert_tools import create_v2_certificate_template
+from cert_tools import create_v3_certificate_template
+from cert_tools import email_hashing
+from cert_tools import helpers
+from cert_tools import image_cache
+from cert_tools import instantiate_v1_2_certificate_batch
+from cert_tools import instantiate_v2_certificate_batch
+from cert_tools import instantiate_v3_certificate_batch
+from cert_tools import json_serializer
+from cert_tools import jsonpath_helpers
+from cert_tools import validation_helpers
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+SMALL_IMAGE_SIZE = 64
+PER_RECIPIENT_FIELDS = [{'path': '$.evidence', 'value': '*|EVIDENCE|*', 'csv_column': 'evidence'}]
+# the console scripts of setup.py
+ENTRY_POINTS = collections.OrderedDict([
+    ('create_certificate_template', 'cert_tools.create_v3_certificate_template'),
+    ('create_certificate_template_v2', 'cert_tools.create_v2_certificate_template'),
+    ('create_certificate_templates', 'cert_tools.create_certificate_templates'),
+    ('instantiate_certificate_batch', 'cert_tools.instantiate_v3_certificate_batch'),
+    ('instantiate_certificate_batch_v2', 'cert_tools.instantiate_v2_certificate_batch'),
+    ('create_issuer', 'cert_tools.create_v2_issuer'),
+])
+
+
+def no_validation(cert):
+    return True
+
+
+def write_image(path, size):
+    with open(path, 'wb') as image:
+        image.write(PNG_SIGNATURE + os.urandom(max(size - len(PNG_SIGNATURE), 0)))
+
+
+def write_roster(path, size, v1_2=False):
+    with open(path, 'w', newline='') as roster:
+        writer = csv.writer(roster)
+        if v1_2:
+            writer.writerow(['givenName', 'familyName', 'pubkey', 'identity', 'evidence'])
+        else:
+            writer.writerow(['name', 'pubkey', 'identity', 'evidence'])
+        for i in range(size):
+            name = ['Recipient', str(i)] if v1_2 else ['Recipient ' + str(i)]
+            writer.writerow(name + ['ecdsa-koblitz-pubkey:mtr98kany9G1XYNU74pRnfBQm{0:07d}'.format(i),
+                                    'recipient{0}@example.org'.format(i),
+                                    'https://example.org/evidence/{0}'.format(i)])
+
+
+class BenchmarkContext:
+    """Synthetic data directory with rosters and v1.2, v2 and v3 templates"""
+    def __init__(self, data_dir, image_size):
+        self.data_dir = data_dir
+        self.image_size = image_size
+        os.makedirs(os.path.join(data_dir, 'images'))
+        os.makedirs(os.path.join(data_dir, 'rosters'))
+        os.makedirs(os.path.join(data_dir, 'certificate_templates'))
+        write_image(os.path.join(data_dir, 'images', 'large.png'), image_size)
+        write_image(os.path.join(data_dir, 'images', 'small.png'), SMALL_IMAGE_SIZE)
+        self.templates = {}
+        self.rosters = set()
+
+    def config(self, image='large', roster_size=0, v1_2=False):
+        roster = 'roster_{0}{1}.csv'.format(roster_size, '_v1_2' if v1_2 else '')
+        image_file = os.path.join('images', image + '.png')
+        return argparse.Namespace(
+            abs_data_dir=self.data_dir,
+            template_dir='certificate_templates',
+            template_file_name='template_{0}.json'.format(image),
+            roster=os.path.join('rosters', roster),
+            issuer_url='https://www.issuer.org',
+            issuer_certs_url='https://www.issuer.org/certificates/',
+            issuer_id='https://www.issuer.org/issuer.json',
+            issuer_email='contact@issuer.org',
+            issuer_name='University of Learning',
+            issuer_public_key='ecdsa-koblitz-pubkey:msBCHdwaQ7N2ypBYupkp6uNxtr9Pg76imj',
+            revocation_list='https://www.issuer.org/revocation-list.json',
+            issuer_logo_file=image_file,
+            cert_image_file=image_file,
+            issuer_signature_file=image_file,
+            issuer_signature_lines=[{'job_title': 'University Issuer', 'signature_image': image_file,
+                                     'name': 'Your signature'}],
+            certificate_title='Certificate of Accomplishment',
+            certificate_description='Lorem ipsum dolor sit amet',
+            certificate_language='en',
+            criteria_narrative='Nibh iriure ei nam',
+            badge_id='82a4c9f2-3588-457b-80ea-da695571b8fc',
+            display_html='<h1>Certificate of Accomplishment</h1>',
+            hash_emails=False,
+            hash_threads=1,
+            compact_json=False,
+            json_backend='auto',
+            additional_global_fields=None,
+            additional_per_recipient_fields=PER_RECIPIENT_FIELDS)
+
+    def roster(self, config, size, v1_2=False):
+        if (size, v1_2) not in self.rosters:
+            write_roster(os.path.join(self.data_dir, config.roster), size, v1_2)
+            self.rosters.add((size, v1_2))
+
+    def template(self, version, image):
+        key = (version, image)
+        if key not in self.templates:
+            config = self.config(image)
+            if version == 'v3':
+                template = create_v3_certificate_template.create_v3_template(config)
+            elif version == 'v2':
+                template = create_v2_certificate_template.create_certificate_template(config)
+            else:
+                config.template_file_name = 'template_v1_2_{0}.json'.format(image)
+                template = create_v1_2_certificate_template.create_certificate_template(config)
+            self.templates[key] = template
+        return self.templates[key]
+
+    def recipients(self, module, size, v1_2=False):
+        config = self.config(roster_size=size, v1_2=v1_2)
+        self.roster(config, size, v1_2)
+        return module.get_recipients_from_roster(config)
+
+
+def consume(iterator):
+    collections.deque(iterator, maxlen=0)
+
+
+def bench_roster_parsing(context, size):
+    context.roster(context.config(roster_size=size), size)
+    return lambda: consume(context.recipients(instantiate_v3_certificate_batch, size))
+
+
+def make_instantiate_v3(validate):
+    def bench(context, size):
+        template = context.template('v3', 'large')
+        context.roster(context.config(roster_size=size), size)
+
+        def run():
+            recipients = context.recipients(instantiate_v3_certificate_batch, size)
+            consume(instantiate_v3_certificate_batch.iter_unsigned_certificates_from_roster(
+                template, recipients, False, PER_RECIPIENT_FIELDS, validate=validate))
+        return run
+    return bench
+
+
+def make_instantiate_v2(image, validate):
+    def bench(context, size):
+        template = context.template('v2', image)
+        context.roster(context.config(roster_size=size), size)
+
+        def run():
+            recipients = context.recipients(instantiate_v2_certificate_batch, size)
+            consume(instantiate_v2_certificate_batch.iter_unsigned_certificates_from_roster(
+                template, recipients, False, PER_RECIPIENT_FIELDS, False, validate=validate))
+        return run
+    return bench
+
+
+def make_instantiate_v1_2(image):
+    def bench(context, size):
+        template = context.template('v1_2', image)
+        config = context.config(image, size, v1_2=True)
+        context.roster(config, size, v1_2=True)
+
+        def run():
+            recipients = context.recipients(instantiate_v1_2_certificate_batch, size, v1_2=True)
+            consume(instantiate_v1_2_certificate_batch.iter_unsigned_certificates_from_roster(
+                config, template, recipients))
+        return run
+    return bench
+
+
+class _Identity:
+    __slots__ = ('identity', 'salted_identity')
+
+    def __init__(self, identity):
+        self.identity = identity
+        self.salted_identity = None
+
+
+def bench_email_hashing_per_row(context, size):
+    emails = ['recipient{0}@example.org'.format(i) for i in range(size)]
+
+    def run():
+        # what hash_emails did per recipient before batching
+        for email in emails:
+            salt = helpers.encode(int.from_bytes(os.urandom(email_hashing.SALT_BYTES), 'big'))
+            email_hashing.hash_and_salt_email_address(email, salt)
+    return run
+
+
+def make_email_hashing(threads):
+    def bench(context, size):
+        recipients = [_Identity('recipient{0}@example.org'.format(i)) for i in range(size)]
+        return lambda: consume(email_hashing.iter_salted_recipients(recipients, threads))
+    return bench
+
+
+def bench_set_field(context, iterations):
+    def run():
+        cert = {'badge': {'issuer': {}}}
+        for i in range(iterations):
+            jsonpath_helpers.set_field(cert, '$.badge.issuer.name', i)
+    return run
+
+
+def bench_encode_image(context, iterations):
+    image = os.path.join(context.data_dir, 'images', 'large.png')
+
+    def run():
+        for _ in range(iterations):
+            helpers.encode_image(image)
+    return run
+
+
+def bench_encode_image_uncached(context, iterations):
+    image = os.path.join(context.data_dir, 'images', 'large.png')
+
+    def run():
+        for _ in range(iterations):
+            image_cache.encode_file(image)
+    return run
+
+
+def make_startup(module):
+    def bench(context, runs):
+        # a fresh interpreter per run, as the job scheduler starts them; None times the bare interpreter
+        command = [sys.executable, '-c', 'pass'] if module is None else [sys.executable, '-m', module, '--help']
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [helpers.PROJECT_ROOT, os.environ.get('PYTHONPATH')])))
+
+        def run():
+            for _ in range(runs):
+                subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+                               cwd=context.data_dir, env=env)
+        return run
+    return bench
+
+
+def make_validation(validate, version):
+    def bench(context, iterations):
+        template = context.template(version, 'large')
+        module = instantiate_v3_certificate_batch if version == 'v3' else instantiate_v2_certificate_batch
+        recipients = context.recipients(module, 1)
+        if version == 'v3':
+            certs = module.iter_unsigned_certificates_from_roster(template, recipients, False, PER_RECIPIENT_FIELDS,
+                                                                  validate=no_validation)
+        else:
+            certs = module.iter_unsigned_certificates_from_roster(template, recipients, False, PER_RECIPIENT_FIELDS,
+                                                                  False, validate=no_validation)
+        _, cert = next(certs)
+
+        def run():
+            for _ in range(iterations):
+                validate(cert)
+        return run
+    return bench
+
+
+def make_serialization(backend, compact):
+    def bench(context, iterations):
+        template = context.template('v2', 'large')
+        recipients = context.recipients(instantiate_v2_certificate_batch, 1)
+        _, cert = next(instantiate_v2_certificate_batch.iter_unsigned_certificates_from_roster(
+            template, recipients, False, PER_RECIPIENT_FIELDS, False, validate=no_validation))
+        serializer = json_serializer.JsonSerializer(backend, compact)
+
+        def run():
+            for _ in range(iterations):
+                serializer.dumpb(cert)
+        return run
+    return bench
+
+
+def schema_validator_v3(cert):
+    from cert_schema import schema_validator
+    return schema_validator.validate_v3(cert, True)
+
+
+def schema_validator_v2(cert):
+    from cert_schema import schema_validator
+    return schema_validator.validate_v2(cert)
+
+
+def validation_helpers_v3(cert):
+    return validation_helpers.validate_v3(cert, True)
+
+
+# name -> (setup function returning the callable to time, whether it scales with the roster size or --iterations)
+BENCHMARKS = collections.OrderedDict([
+    ('roster_parsing', (bench_roster_parsing, 'roster')),
+    ('instantiate_v3', (make_instantiate_v3(no_validation), 'roster')),
+    ('instantiate_v3_validated', (make_instantiate_v3(None), 'roster')),
+    ('instantiate_v2_large_images', (make_instantiate_v2('large', no_validation), 'roster')),
+    ('instantiate_v2_small_images', (make_instantiate_v2('small', no_validation), 'roster')),
+    ('instantiate_v2_validated', (make_instantiate_v2('large', None), 'roster')),
+    ('instantiate_v1_2_large_images', (make_instantiate_v1_2('large'), 'roster')),
+    ('instantiate_v1_2_small_images', (make_instantiate_v1_2('small'), 'roster')),
+    ('email_hashing_per_row', (bench_email_hashing_per_row, 'roster')),
+    ('email_hashing', (make_email_hashing(1), 'roster')),
+    ('email_hashing_threads', (make_email_hashing(os.cpu_count() or 1), 'roster')),
+    ('jsonpath_set_field', (bench_set_field, 'iterations')),
+    ('encode_image', (bench_encode_image, 'iterations')),
+    ('encode_image_uncached', (bench_encode_image_uncached, 'iterations')),
+    ('schema_validator_validate_v3', (make_validation(schema_validator_v3, 'v3'), 'iterations')),
+    ('schema_validator_validate_v2', (make_validation(schema_validator_v2, 'v2'), 'iterations')),
+    ('validation_helpers_validate_v3', (make_validation(validation_helpers_v3, 'v3'), 'iterations')),
+    ('validation_helpers_validate_v2', (make_validation(validation_helpers.validate_v2, 'v2'), 'iterations')),
+    ('serialize_v2', (make_serialization('json', False), 'iterations')),
+    ('serialize_v2_compact_json', (make_serialization('json', True), 'iterations')),
+    ('serialize_v2_compact_ujson', (make_serialization('ujson', True), 'iterations')),
+    ('serialize_v2_compact_orjson', (make_serialization('orjson', True), 'iterations')),
+])
+BENCHMARKS['startup_interpreter'] = (make_startup(None), 'startup')
+for script, module in ENTRY_POINTS.items():
+    BENCHMARKS['startup_' + script] = (make_startup(module), 'startup')
+
+
+def run_benchmark(name, function, context, size, repeat):
+    result = {'name': name, 'size': size}
+    timings = []
+    try:
+        run = function(context, size)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    except Exception as e:
+        result['error'] = '{0}: {1}'.format(e.__class__.__name__, str(e).splitlines()[0] if str(e) else '')
+        return result
+    best = min(timings)
+    result['seconds'] = best
+    result['items_per_second'] = size / best if best else None
+    result['microseconds_per_item'] = best * 1e6 / size if size else None
+    return result
+
+
+def run_benchmarks(config):
+    data_dir = tempfile.mkdtemp(prefix='cert_tools_benchmark_')
+    try:
+        context = BenchmarkContext(data_dir, config.image_size)
+        results = []
+        for name, (function, scale) in BENCHMARKS.items():
+            if config.benchmarks and name not in config.benchmarks:
+                continue
+            if scale == 'roster':
+                sizes = config.sizes
+            elif scale == 'startup':
+                sizes = [config.startup_runs]
+            else:
+                sizes = [config.iterations]
+            for size in sizes:
+                result = run_benchmark(name, function, context, size, config.repeat)
+                results.append(result)
+                if 'error' in result:
+                    print('{0:<40} {1:>9} {2}'.format(name, size, result['error']), file=sys.stderr)
+                else:
+                    print('{0:<40} {1:>9} {2:>12.1f} items/s'.format(name, size, result['items_per_second']),
+                          file=sys.stderr)
+    finally:
+        shutil.rmtree(data_dir)
+
+    return {
+        'cert_tools_version': __version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'created': helpers.create_iso8601_tz(),
+        'image_size': config.image_size,
+        'repeat': config.repeat,
+        'results': results
+    }
+
+
+def get_config():
+    p = configargparse.getArgumentParser()
+    p.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                   help='synthetic roster sizes to benchmark, e.g. 1000 100000 1000000')
+    p.add_argument('--iterations', type=int, default=1000,
+                   help='number of calls for the benchmarks that do not depend on a roster')
+    p.add_argument('--startup_runs', type=int, default=10,
+                   help='number of interpreter starts timed for each console script')
+    p.add_argument('--image_size', type=int, default=100000,
+                   help='size in bytes of the large synthetic images embedded in templates')
+    p.add_argument('--repeat', type=int, default=1, help='number of runs per benchmark; the best is reported')
+    p.add_argument('--benchmarks', type=str, nargs='+', choices=list(BENCHMARKS.keys()),
+                   help='only run these benchmarks')
+    p.add_argument('-o', '--output_file', type=str, help='the output file for the JSON results (default: stdout)')
+    args, _ = p.parse_known_args()
+    return args
+
+
+def main():
+    conf = get_config()
+    results = run_benchmarks(conf)
+    output = json.dumps(results, indent=2)
+    if conf.output_file:
+        with open(conf.output_file, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+'''
+Checkpoint journal for resumable batch instantiation.
+
+The journal is a JSON Lines file. The first line records the batch settings that must not change on resume
+(issue date and roster). Before a certificate is handed to the output sink, a line records its roster row and the
+uid it was assigned, e.g. {"row": 41, "uid": "0d3b..."}. Rows are committed in groups: once the sink has been
+flushed, a line such as {"written": 42} records that the certificates of every row before 42 are in place, along
+with the length of the output file for the jsonl sink, e.g. {"written": 42, "offset": 1048576}.
+
+On resume, the rows before the last commit are skipped. The rows after it are instantiated again under the uids
+journaled for them, so their certificates replace whatever the interrupted run left instead of being issued twice.
+Each line is appended with a single write: a crash can at worst leave a truncated last line, which is cut off.
+'''
+import json
+import os
+
+
+def _read_complete_lines(journal_file):
+    """
+    Return (header, {row: uid}, number of rows written, output length, length in bytes) of the complete lines of
+    JOURNAL_FILE
+    """
+    header = None
+    uids = {}
+    written = 0
+    offset = None
+    length = 0
+    with open(journal_file, 'rb') as journal:
+        for line in journal:
+            if not line.endswith(b'\n'):
+                # partially written last line
+                break
+            length += len(line)
+            entry = json.loads(line.decode('utf-8'))
+            if header is None:
+                header = entry
+            elif 'written' in entry:
+                written = entry['written']
+                offset = entry.get('offset')
+            else:
+                uids[entry['row']] = entry['uid']
+    return header, uids, written, offset, length
+
+
+def read_journal(journal_file):
+    """Return (header, {row: uid}, number of rows written) for the complete lines of JOURNAL_FILE"""
+    header, uids, written, _, _ = _read_complete_lines(journal_file)
+    return header, uids, written
+
+
+class CheckpointJournal:
+    def __init__(self, journal_file, roster, issued_on, resume=False, commit_every=100):
+        """
+        :param journal_file: path of the journal
+        :param roster: the roster file; resuming against another roster is refused
+        :param issued_on: issue date of a new batch. On resume, the date recorded by the interrupted run is kept
+        :param resume: continue from an existing journal instead of starting a new one
+        :param commit_every: number of rows recorded between commits
+        """
+        self.journal_file = journal_file
+        # uids assigned by previous runs, by roster row, including rows whose certificates may not have been written
+        self.uids = {}
+        self.issued_on = issued_on
+        self.commit_every = commit_every
+        # first row not committed by previous runs
+        self.start_row = 0
+        # length of the output file at the last commit, for the jsonl sink
+        self.offset = None
+        self.pending = 0
+
+        length = 0
+        header = None
+        if resume and os.path.isfile(journal_file):
+            header, self.uids, self.start_row, self.offset, length = _read_complete_lines(journal_file)
+            if header is not None:
+                if header['roster'] != roster:
+                    raise Exception('checkpoint {0} was written for roster {1}'.format(journal_file, header['roster']))
+                self.issued_on = header['issued_on']
+        self.next_row = self.start_row
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if header is None:
+            flags |= os.O_TRUNC
+        self.fd = os.open(journal_file, flags, 0o644)
+        if header is not None:
+            # drop a partially written last line, or the next line would be appended to it
+            os.ftruncate(self.fd, length)
+        else:
+            self.write({'roster': roster, 'issued_on': self.issued_on})
+
+    def write(self, entry):
+        os.write(self.fd, (json.dumps(entry) + '\n').encode('utf-8'))
+
+    def record(self, uid):
+        """Journal UID as the uid of the next roster row; call before its certificate is handed to the sink"""
+        self.write({'row': self.next_row, 'uid': uid})
+        self.next_row += 1
+        self.pending += 1
+
+    def commit(self, offset=None):
+        """
+        Mark the recorded rows as written; call once the sink has been flushed. OFFSET is the length of the output
+        file of a single-file sink
+        """
+        if self.pending:
+            entry = {'written': self.next_row}
+            if offset is not None:
+                entry['offset'] = offset
+            self.write(entry)
+            self.pending = 0
+
+    def close(self):
+        """Close the journal; rows recorded since the last commit are instantiated again on resume"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+'''
+Creates many certificate templates in one process, from a JSON manifest:
+
+    {
+      "version": "v2",
+      "defaults": {"data_dir": "sample_data", "issuer_name": "University of Learning", ...},
+      "templates": [
+        {"template_file_name": "physics.json", "certificate_title": "Physics", "badge_id": "..."},
+        {"template_file_name": "history.json", "certificate_title": "History", "badge_id": "..."}
+      ]
+    }
+
+Each template is built from the shared defaults (typically the issuer section) updated with its own overrides.
+Keys are the options of create_v3_certificate_template (version v3, the default) or create_v2_certificate_template
+(version v2); the field list options take a list, or the {"fields": [...]} object used in conf.ini. Relative data
+directories are resolved against the current directory, as with the single template tools.
+
+Compared to one run per template, the interpreter and its imports are loaded once, images shared by the templates
+(issuer logo, signatures) are encoded once through the image cache, and jsonpath fields are parsed once.
+'''
+import argparse
+import json
+import os
+
+import configargparse
+
+from cert_tools import create_v2_certificate_template
+from cert_tools import create_v3_certificate_template
+from cert_tools import image_cache
+
+TEMPLATE_MODULES = {
+    'v2': create_v2_certificate_template,
+    'v3': create_v3_certificate_template
+}
+
+# the options of each single template tool, with their defaults
+TEMPLATE_OPTIONS = {
+    'v2': {
+        'data_dir': None, 'issuer_logo_file': None, 'cert_image_file': None, 'issuer_url': None,
+        'issuer_certs_url': None, 'issuer_email': None, 'issuer_name': None, 'issuer_id': None, 'issuer_key': None,
+        'certificate_description': None, 'certificate_title': None, 'criteria_narrative': None,
+        'template_dir': None, 'template_file_name': None, 'hash_emails': False, 'revocation_list': None,
+        'issuer_public_key': None, 'badge_id': None, 'issuer_signature_lines': None,
+        'additional_global_fields': None, 'additional_per_recipient_fields': None, 'display_html': None,
+        'compact_json': False, 'json_backend': 'auto'
+    },
+    'v3': {
+        'data_dir': None, 'issuer_url': None, 'issuer_id': None, 'template_dir': None, 'template_file_name': None,
+        'additional_global_fields': None, 'additional_per_recipient_fields': None,
+        'compact_json': False, 'json_backend': 'auto'
+    }
+}
+
+REQUIRED_OPTIONS = {
+    'v2': ['data_dir', 'template_dir', 'template_file_name', 'issuer_email', 'issuer_name', 'issuer_id',
+           'certificate_title', 'criteria_narrative', 'badge_id'],
+    'v3': ['data_dir', 'template_dir', 'template_file_name', 'issuer_id']
+}
+
+FIELD_LIST_OPTIONS = ['issuer_signature_lines', 'additional_global_fields', 'additional_per_recipient_fields']
+
+
+def get_template_config(version, defaults, overrides, cwd):
+    """Return the configuration of one template, as the single template tool would parse it"""
+    if version not in TEMPLATE_OPTIONS:
+        raise Exception('unknown template version {0}; expected v2 or v3'.format(version))
+    options = TEMPLATE_OPTIONS[version]
+    values = dict(options)
+    values.update(defaults)
+    values.update(overrides)
+
+    name = values.get('template_file_name')
+    unknown = sorted(key for key in values if key not in options)
+    if unknown:
+        raise Exception('template {0}: unknown option(s) {1}'.format(name, ', '.join(unknown)))
+    missing = [key for key in REQUIRED_OPTIONS[version] if not values[key]]
+    if missing:
+        raise Exception('template {0}: missing option(s) {1}'.format(name, ', '.join(missing)))
+    for key in FIELD_LIST_OPTIONS:
+        if isinstance(values.get(key), dict):
+            values[key] = values[key]['fields']
+
+    config = argparse.Namespace(**values)
+    config.abs_data_dir = os.path.abspath(os.path.join(cwd, config.data_dir))
+    return config
+
+
+def iter_template_configs(manifest, cwd=None):
+    cwd = cwd or os.getcwd()
+    version = manifest.get('version', 'v3')
+    defaults = manifest.get('defaults', {})
+    seen = set()
+    for overrides in manifest['templates']:
+        config = get_template_config(version, defaults, overrides, cwd)
+        path = os.path.join(config.abs_data_dir, config.template_dir, config.template_file_name)
+        if path in seen:
+            raise Exception('more than one template is written to ' + path)
+        seen.add(path)
+        yield config
+
+
+def write_certificate_templates(manifest, cwd=None):
+    """Write every template of MANIFEST; return the number written"""
+    module = TEMPLATE_MODULES[manifest.get('version', 'v3')]
+    # check the whole manifest before writing anything
+    configs = list(iter_template_configs(manifest, cwd))
+    for config in configs:
+        module.write_certificate_template(config)
+    return len(configs)
+
+
+def get_config():
+    p = configargparse.getArgumentParser()
+    p.add_argument('-m', '--manifest_file', type=str, required=True, help='JSON manifest of the templates to create')
+    p.add_argument('--image_cache_dir', type=str, help='directory of a persistent cache of encoded images, shared between runs')
+    args, _ = p.parse_known_args()
+    return args
+
+
+def main():
+    conf = get_config()
+    if conf.image_cache_dir:
+        image_cache.configure(conf.image_cache_dir)
+    with open(conf.manifest_file) as manifest_file:
+        manifest = json.load(manifest_file)
+    count = write_certificate_templates(manifest)
+    cache = image_cache.get_cache()
+    print('Created {0} templates! ({1} images encoded, {2} reused)'.format(count, cache.misses, cache.hits))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ import datetime
 import configargparse
 
 from cert_tools import helpers
+from cert_tools import image_cache
 
 def generate_issuer_file(config):
     output_handle = open(config.output_file, 'w') if config.output_file else sys.stdout
@@ -59,6 +60,7 @@ def get_config():
     p.add_argument('-e', '--issuer_email', type=str, help='the issuer\'s email')
     p.add_argument('-m', '--issuer_logo_file', type=str, help='the issuer\' logo image')
     p.add_argument('-o', '--output_file', type=str, help='the output file to save the issuer\'s identification file')
+    p.add_argument('--image_cache_dir', type=str, help='directory of a persistent cache of encoded images, shared between runs')
     args, _ = p.parse_known_args()
 
     return args
@@ -66,6 +68,8 @@ def get_config():
 
 def main():
     conf = get_config()
+    if conf.image_cache_dir:
+        image_cache.configure(conf.image_cache_dir)
     generate_issuer_file(conf)
 
 
@@ -2,33 +2,134 @@
 '''
 Generates Bitcoin addresses using an HD extended public key to be used as the issuer's revocation addresses for the certificates. 
 
-It creates a list of addresses that could then be easily merged with the roster file, e.g. using unix's paste command.
+It creates a list of addresses that could then be easily merged with the roster file, e.g. using unix's paste command,
+or, given a roster, streams it and writes a copy with a revocation address column appended to every row.
 '''
+import csv
+import itertools
 import os
 import sys
 
 import configargparse
-from pycoin.key.BIP32Node import BIP32Node
 
+from cert_tools import derivation_cache
+from cert_tools import parallel_helpers
 
-def generate_revocation_addresses(config):
+BUFFER_SIZE = 1 << 20
+
+
+def get_key_path_node(extended_public_key, key_path):
+    """Return the node under which the revocation addresses are derived"""
+    # pycoin is only needed once addresses are derived, not for --help or cached runs
+    from pycoin.key.BIP32Node import BIP32Node
+    key = BIP32Node.from_text(extended_public_key)
+    return key.subkey_for_path(key_path)
+
+
+def derive_addresses(key_path_batch, indexes, use_uncompressed):
+    return [key_path_batch.subkey(i).address(use_uncompressed) for i in indexes]
+
+
+# per-process state of a --workers pool; each worker parses the key once
+_worker_state = {}
+
+
+def _init_worker(extended_public_key, key_path, use_uncompressed):
+    _worker_state['key_path_batch'] = get_key_path_node(extended_public_key, key_path)
+    _worker_state['use_uncompressed'] = use_uncompressed
+
+
+def _derive_chunk(indexes):
+    return derive_addresses(_worker_state['key_path_batch'], indexes, _worker_state['use_uncompressed'])
+
+
+def iter_revocation_addresses(config, number_of_addresses=None):
+    """
+    Yield the addresses at indexes start_index to start_index + number_of_addresses - 1, in index order. If
+    NUMBER_OF_ADDRESSES is None the sequence is unbounded; close the generator when done.
+    """
     key_path = config.key_path if config.key_path else ''
-    output_handle = open(config.output_file, 'w') if config.output_file else sys.stdout
 
+    def get_indexes():
+        if number_of_addresses is None:
+            return itertools.count(config.start_index)
+        return range(config.start_index, config.start_index + number_of_addresses)
+
+    def derive(indexes):
+        # the key is only parsed once an address has to be derived, so a fully cached run never loads pycoin
+        try:
+            key_path_batch = get_key_path_node(config.extended_public_key, key_path)
+        except:
+            print('The extended public (or private) key seems invalid.')
+            sys.exit()
+        if config.workers > 1:
+            # EC math is pure Python, so the index range is split across processes; results come back in order
+            yield from parallel_helpers.imap_chunks(_derive_chunk, indexes, config.workers, config.chunk_size,
+                                                    _init_worker,
+                                                    (config.extended_public_key, key_path, config.use_uncompressed))
+        else:
+            for i in indexes:
+                yield key_path_batch.subkey(i).address(config.use_uncompressed)
+
+    if not config.cache_dir:
+        return derive(get_indexes())
+    cache = derivation_cache.DerivationCache(config.cache_dir, config.extended_public_key, key_path,
+                                             config.use_uncompressed)
+    return _iter_cached_addresses(cache, get_indexes, derive)
+
+
+def _iter_cached_addresses(cache, get_indexes, derive):
+    """Yield cached addresses, deriving and caching only the indexes that are missing"""
+    derived = derive(i for i in get_indexes() if cache.get(i) is None)
     try:
-        key = BIP32Node.from_text(config.extended_public_key)
-    except:
-        print('The extended public (or private) key seems invalid.')
-        sys.exit()
-    key_path_batch = key.subkey_for_path(key_path)
-    for i in range(config.number_of_addresses):
-        subkey = key_path_batch.subkey(i)
-        output_handle.write("{0}\n".format(subkey.address(config.use_uncompressed)))
+        for i in get_indexes():
+            address = cache.get(i)
+            if address is None:
+                address = next(derived)
+                cache.put(i, address)
+            yield address
+    finally:
+        derived.close()
+        cache.close()
+
+
+def generate_revocation_addresses(config):
+    output_handle = open(config.output_file, 'w', buffering=BUFFER_SIZE) if config.output_file else sys.stdout
+
+    for address in iter_revocation_addresses(config, config.number_of_addresses):
+        output_handle.write(address + '\n')
 
     if output_handle is not sys.stdout:
         output_handle.close()
 
 
+def add_revocation_addresses_to_roster(config):
+    """
+    Copy the roster to the output with a revocation_column holding one derived address per row, in a single
+    streaming pass; neither file is loaded into memory. Row N gets the address at index start_index + N. Blank lines,
+    which the instantiate tools skip, are copied as they are and don't count as rows.
+    """
+    output_handle = open(config.output_file, 'w', newline='', buffering=BUFFER_SIZE) if config.output_file else sys.stdout
+    addresses = iter_revocation_addresses(config)
+    try:
+        with open(config.roster, newline='') as roster:
+            reader = csv.reader(roster)
+            writer = csv.writer(output_handle)
+            header = next(reader)
+            if config.revocation_column in header:
+                raise Exception('roster {0} already has a {1} column'.format(config.roster, config.revocation_column))
+            writer.writerow(header + [config.revocation_column])
+            for row in reader:
+                if row:
+                    row.append(next(addresses))
+                writer.writerow(row)
+    finally:
+        # stops the worker pool, which may have derived a few addresses past the last row
+        addresses.close()
+        if output_handle is not sys.stdout:
+            output_handle.close()
+
+
 def get_config():
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
     p = configargparse.getArgumentParser(default_config_files=[os.path.join(base_dir, 'conf.ini')])
@@ -42,6 +143,16 @@ def get_config():
     p.add_argument('-o', '--output_file', type=str, help='the output file to save the revocation addresses')
     p.add_argument('-u', '--use_uncompressed', action='store_true', default=False,
                    help='whether to use uncompressed bitcoin addresses')
+    p.add_argument('-s', '--start_index', type=int, default=0,
+                   help='index of the first address, to extend an earlier range without deriving it again')
+    p.add_argument('--workers', type=int, default=1, help='number of worker processes used to derive addresses')
+    p.add_argument('--chunk_size', type=int, default=1000, help='number of addresses handed to a worker at a time')
+    p.add_argument('--cache_dir', type=str,
+                   help='directory of a cache of derived addresses, so repeated or extended runs only derive new indexes')
+    p.add_argument('-r', '--roster', type=str,
+                   help='a roster csv file to copy with a revocation address appended to each row, instead of a plain list')
+    p.add_argument('--revocation_column', type=str, default='revkey',
+                   help='the name of the roster column holding the revocation addresses')
     args, _ = p.parse_known_args()
 
     return args
@@ -49,7 +160,10 @@ def get_config():
 
 def main():
     conf = get_config()
-    generate_revocation_addresses(conf)
+    if conf.roster:
+        add_revocation_addresses_to_roster(conf)
+    else:
+        generate_revocation_addresses(conf)
 
 
 if __name__ == "__main__":
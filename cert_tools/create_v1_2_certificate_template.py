@@ -3,12 +3,13 @@
 '''
 Creates a certificate template with merge tags for recipient/assertion-specific data.
 '''
-import json
 import os
 
 import configargparse
 
 from cert_tools import helpers
+from cert_tools import image_cache
+from cert_tools import json_serializer
 from cert_tools import jsonpath_helpers
 
 
@@ -97,8 +98,7 @@ def create_certificate_template(config):
 
     template_path = os.path.join(config.abs_data_dir, template_dir, template_file_name)
 
-    with open(template_path, 'w') as cert_template:
-        json.dump(raw_json, cert_template)
+    json_serializer.get_serializer(config).dump_file(raw_json, template_path)
 
     return raw_json
 
@@ -129,6 +129,8 @@ def get_config():
                    help='additional global fields')
     p.add_argument('--additional_per_recipient_fields', action=helpers.make_action('per_recipient_fields'),
                    help='additional per-recipient fields')
+    p.add_argument('--image_cache_dir', type=str, help='directory of a persistent cache of encoded images, shared between runs')
+    json_serializer.add_serializer_arguments(p)
 
     args, _ = p.parse_known_args()
     args.abs_data_dir = os.path.abspath(os.path.join(cwd, args.data_dir))
@@ -137,6 +139,8 @@ def get_config():
 
 def main():
     conf = get_config()
+    if conf.image_cache_dir:
+        image_cache.configure(conf.image_cache_dir)
     template = create_certificate_template(conf)
     print('Created template!')
 
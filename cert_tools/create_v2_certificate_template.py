@@ -3,20 +3,30 @@
 '''
 Creates a certificate template with merge tags for recipient/assertion-specific data.
 '''
-import json
 import os
 import uuid
 
 import configargparse
 
 from cert_tools import helpers
+from cert_tools import image_cache
+from cert_tools import json_serializer
 from cert_tools import jsonpath_helpers
 
 from cert_core.cert_model.model import scope_name
-from cert_schema import OPEN_BADGES_V2_CANONICAL_CONTEXT, BLOCKCERTS_V2_CANONICAL_CONTEXT
 
-OPEN_BADGES_V2_CONTEXT = OPEN_BADGES_V2_CANONICAL_CONTEXT
-BLOCKCERTS_V2_CONTEXT = BLOCKCERTS_V2_CANONICAL_CONTEXT
+_CONTEXTS = {
+    'OPEN_BADGES_V2_CONTEXT': 'OPEN_BADGES_V2_CANONICAL_CONTEXT',
+    'BLOCKCERTS_V2_CONTEXT': 'BLOCKCERTS_V2_CANONICAL_CONTEXT'
+}
+
+
+def __getattr__(name):
+    # the context constants are only imported from cert_schema when used, to keep startup fast
+    if name in _CONTEXTS:
+        import cert_schema
+        return getattr(cert_schema, _CONTEXTS[name])
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
 
 
 def create_badge_section(config):
@@ -90,10 +100,11 @@ def create_recipient_profile_section():
 
 
 def create_assertion_section(config):
+    from cert_schema import OPEN_BADGES_V2_CANONICAL_CONTEXT, BLOCKCERTS_V2_CANONICAL_CONTEXT
     assertion = {
         '@context': [
-            OPEN_BADGES_V2_CONTEXT,
-            BLOCKCERTS_V2_CONTEXT,
+            OPEN_BADGES_V2_CANONICAL_CONTEXT,
+            BLOCKCERTS_V2_CANONICAL_CONTEXT,
             {
                 "displayHtml": {"@id": "schema:description"}
             }
@@ -146,8 +157,7 @@ def write_certificate_template(config):
     template_path = os.path.join(config.abs_data_dir, template_dir, template_file_name)
 
     print('Writing template to ' + template_path)
-    with open(template_path, 'w') as cert_template:
-        json.dump(assertion, cert_template)
+    json_serializer.get_serializer(config).dump_file(assertion, template_path)
 
 
 def get_config():
@@ -183,6 +193,8 @@ def get_config():
     p.add_argument('--additional_per_recipient_fields', action=helpers.make_action('per_recipient_fields'),
                    help='additional per-recipient fields')
     p.add_argument('--display_html', type=str, help='html content to display')
+    p.add_argument('--image_cache_dir', type=str, help='directory of a persistent cache of encoded images, shared between runs')
+    json_serializer.add_serializer_arguments(p)
 
     args, _ = p.parse_known_args()
     args.abs_data_dir = os.path.abspath(os.path.join(cwd, args.data_dir))
@@ -191,6 +203,8 @@ def get_config():
 
 def main():
     conf = get_config()
+    if conf.image_cache_dir:
+        image_cache.configure(conf.image_cache_dir)
     write_certificate_template(conf)
     print('Created template!')
 
@@ -6,16 +6,26 @@ Currently, just not check for inputs' validity (e.g. valid address, URLs, etc.)
 '''
 import os
 import sys
-from cert_schema import *
 import configargparse
 import json
 
 from cert_tools import helpers
+from cert_tools import image_cache
 
 ISSUER_TYPE = 'Profile'
 
-OPEN_BADGES_V2_CONTEXT_JSON = OPEN_BADGES_V2_CANONICAL_CONTEXT
-BLOCKCERTS_V2_CONTEXT_JSON = BLOCKCERTS_V2_CANONICAL_CONTEXT
+_CONTEXTS = {
+    'OPEN_BADGES_V2_CONTEXT_JSON': 'OPEN_BADGES_V2_CANONICAL_CONTEXT',
+    'BLOCKCERTS_V2_CONTEXT_JSON': 'BLOCKCERTS_V2_CANONICAL_CONTEXT'
+}
+
+
+def __getattr__(name):
+    # the context constants are only imported from cert_schema when used, to keep startup fast
+    if name in _CONTEXTS:
+        import cert_schema
+        return getattr(cert_schema, _CONTEXTS[name])
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
 
 
 def generate_issuer_file(config):
@@ -26,7 +36,8 @@ def generate_issuer_file(config):
         issued_on = helpers.create_iso8601_tz()
     output_handle = open(config.output_file, 'w') if config.output_file else sys.stdout
 
-    context = [OPEN_BADGES_V2_CONTEXT_JSON, BLOCKCERTS_V2_CONTEXT_JSON]
+    from cert_schema import OPEN_BADGES_V2_CANONICAL_CONTEXT, BLOCKCERTS_V2_CANONICAL_CONTEXT
+    context = [OPEN_BADGES_V2_CANONICAL_CONTEXT, BLOCKCERTS_V2_CANONICAL_CONTEXT]
 
     issuer_json = {
         '@context': context,
@@ -64,6 +75,7 @@ def get_config():
     p.add_argument('-m', '--issuer_logo_file', type=str, help='the issuer\' logo image')
     p.add_argument('-i', '--intro_url', required=False, type=str, help='the issuer\'s introduction URL address')
     p.add_argument('-o', '--output_file', type=str, help='the output file to save the issuer\'s identification file')
+    p.add_argument('--image_cache_dir', type=str, help='directory of a persistent cache of encoded images, shared between runs')
     args, _ = p.parse_known_args()
     args.abs_data_dir = os.path.abspath(os.path.join(cwd, args.data_dir))
 
@@ -72,6 +84,8 @@ def get_config():
 
 def main():
     conf = get_config()
+    if conf.image_cache_dir:
+        image_cache.configure(conf.image_cache_dir)
     generate_issuer_file(conf)
 
 
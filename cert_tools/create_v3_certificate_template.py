@@ -3,16 +3,14 @@
 '''
 Creates a certificate template with merge tags for recipient/assertion-specific data.
 '''
-import json
 import os
 
 import configargparse
 
 from cert_tools import helpers
+from cert_tools import json_serializer
 from cert_tools import jsonpath_helpers
 
-from cert_schema import ContextUrls
-
 
 def create_credential_subject_section(config):
     # An example credential subject for those that don't override
@@ -25,6 +23,8 @@ def create_credential_subject_section(config):
 
 
 def create_v3_assertion(config):
+    # imported here: cert_schema pulls in pyld and requests, which --help doesn't need
+    from cert_schema import ContextUrls
     ContextUrlsInstance = ContextUrls()
     assertion = {
         '@context': [
@@ -66,8 +66,7 @@ def write_certificate_template(config):
     template_path = os.path.join(config.abs_data_dir, template_dir, template_file_name)
 
     print('Writing template to ' + template_path)
-    with open(template_path, 'w') as cert_template:
-        json.dump(assertion, cert_template)
+    json_serializer.get_serializer(config).dump_file(assertion, template_path)
 
 
 def get_config():
@@ -86,6 +85,7 @@ def get_config():
                    help='additional global fields')
     p.add_argument('--additional_per_recipient_fields', action=helpers.make_action('per_recipient_fields'),
                    help='additional per-recipient fields')
+    json_serializer.add_serializer_arguments(p)
 
     args, _ = p.parse_known_args()
     args.abs_data_dir = os.path.abspath(os.path.join(cwd, args.data_dir))
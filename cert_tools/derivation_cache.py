@@ -0,0 +1,71 @@
+'''
+Persistent cache of derived revocation addresses.
+
+Deriving HD child keys is slow, and create_revocation_addresses used to start again from index 0 on every run.
+The cache keeps one file per (extended public key, key path, compressed flag), named after a hash of the three,
+with a fixed-width slot per index: address N is at byte (N + 1) * SLOT_SIZE, behind a header slot, so a lookup
+is a single seek and read and the file can be extended from any index.
+'''
+import hashlib
+import os
+
+SLOT_SIZE = 64
+HEADER = b'cert-tools revocation addresses v1 '
+CACHE_FILE_SUFFIX = '.addresses'
+
+
+def get_cache_key(extended_public_key, key_path, use_uncompressed):
+    text = '{0}\0{1}\0{2}'.format(extended_public_key, key_path or '', 'uncompressed' if use_uncompressed else 'compressed')
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_cache_file(cache_dir, cache_key):
+    return os.path.join(cache_dir, cache_key[:32] + CACHE_FILE_SUFFIX)
+
+
+class DerivationCache:
+    def __init__(self, cache_dir, extended_public_key, key_path, use_uncompressed=False):
+        os.makedirs(cache_dir, exist_ok=True)
+        key = get_cache_key(extended_public_key, key_path, use_uncompressed)
+        self.cache_file = get_cache_file(cache_dir, key)
+        header = (HEADER + key.encode('ascii'))[:SLOT_SIZE].ljust(SLOT_SIZE, b'\0')
+        if os.path.exists(self.cache_file):
+            self.handle = open(self.cache_file, 'r+b')
+            if self.handle.read(SLOT_SIZE) != header:
+                self.handle.close()
+                raise Exception('{0} is not a revocation address cache for this key'.format(self.cache_file))
+        else:
+            self.handle = open(self.cache_file, 'w+b')
+            self.handle.write(header)
+
+    def get(self, index):
+        """Return the cached address at INDEX, or None"""
+        self.handle.seek((index + 1) * SLOT_SIZE)
+        slot = self.handle.read(SLOT_SIZE)
+        if len(slot) < SLOT_SIZE or slot[0] == 0:
+            return None
+        return slot.rstrip(b'\0').decode('ascii')
+
+    def put(self, index, address):
+        data = address.encode('ascii')
+        if len(data) > SLOT_SIZE:
+            raise Exception('address too long for the revocation address cache: ' + address)
+        self.handle.seek((index + 1) * SLOT_SIZE)
+        self.handle.write(data.ljust(SLOT_SIZE, b'\0'))
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def lookup(cache_dir, extended_public_key, key_path, index, use_uncompressed=False):
+    """Return the cached revocation address at INDEX, or None if it hasn't been derived yet"""
+    if not os.path.exists(get_cache_file(cache_dir, get_cache_key(extended_public_key, key_path, use_uncompressed))):
+        return None
+    with DerivationCache(cache_dir, extended_public_key, key_path, use_uncompressed) as cache:
+        return cache.get(index)
@@ -0,0 +1,115 @@
+'''
+Salted email hashing for the v1.2 and v2 instantiate tools (hash_emails).
+
+Each recipient's identity becomes 'sha256$' + sha256(email + salt), with a fresh random salt written next to it in
+the certificate. Salts are 16 random bytes, base 62 encoded like helpers.encode would encode them as a number.
+
+Recipients are hashed in blocks: the salt entropy for a whole block comes from one os.urandom call, salts are
+encoded two digits at a time from a lookup table, and the hashes can be spread over a thread pool. hashlib only
+releases the GIL for inputs of 2 KiB or more, so threads pay off for long identities; short emails are hashed
+in the calling thread by default.
+'''
+import hashlib
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from cert_tools import batch_stats
+from cert_tools import helpers
+
+SALT_BYTES = 16
+DEFAULT_BLOCK_SIZE = 1024
+
+_BASE = len(helpers.BASE62)
+_PAIR_BASE = _BASE * _BASE
+# every two digit base 62 number, so encoding needs half the divisions
+_PAIRS = [a + b for a in helpers.BASE62 for b in helpers.BASE62]
+
+
+def encode_salt(data):
+    """Base 62 encode the bytes DATA as a big-endian number; same result as helpers.encode"""
+    num = int.from_bytes(data, 'big')
+    if num < _BASE:
+        return helpers.BASE62[num]
+    parts = []
+    while num:
+        num, rem = divmod(num, _PAIR_BASE)
+        parts.append(_PAIRS[rem])
+    parts.reverse()
+    encoded = ''.join(parts)
+    # the leading pair may start with a zero digit
+    return encoded[1:] if encoded[0] == helpers.BASE62[0] else encoded
+
+
+def hash_and_salt_email_address(email, salt):
+    return 'sha256$' + hashlib.sha256((email + salt).encode('utf-8')).hexdigest()
+
+
+class SaltSource:
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        :param block_size: number of salts drawn from os.urandom at a time
+        """
+        self.block_size = block_size
+        self.block = []
+
+    def salts(self, count):
+        """Return COUNT new salts"""
+        entropy = os.urandom(SALT_BYTES * count)
+        return [encode_salt(entropy[i:i + SALT_BYTES]) for i in range(0, len(entropy), SALT_BYTES)]
+
+    def next_salt(self):
+        if not self.block:
+            self.block = self.salts(self.block_size)
+        return self.block.pop()
+
+
+_salt_source = SaltSource()
+
+
+def salt_and_hash(email):
+    """Return (salt, hashed identity) for a single EMAIL"""
+    salt = _salt_source.next_salt()
+    return salt, hash_and_salt_email_address(email, salt)
+
+
+def _hash_slice(emails, salts):
+    return [hash_and_salt_email_address(email, salt) for email, salt in zip(emails, salts)]
+
+
+def hash_emails(emails, salts, executor=None, slices=1):
+    """Return the hashed identities of EMAILS with SALTS, split in SLICES hashed on the threads of EXECUTOR if given"""
+    if executor is None or slices < 2:
+        return _hash_slice(emails, salts)
+    step = -(-len(emails) // slices)
+    hashed = executor.map(_hash_slice, [emails[i:i + step] for i in range(0, len(emails), step)],
+                          [salts[i:i + step] for i in range(0, len(salts), step)])
+    return list(itertools.chain.from_iterable(hashed))
+
+
+def iter_salted_recipients(recipients, threads=1, block_size=DEFAULT_BLOCK_SIZE, stats=batch_stats.NULL_STATS):
+    """
+    Yield RECIPIENTS with their salted_identity set to (salt, hashed identity), hashing them a block at a time
+
+    :param threads: number of threads hashing each block
+    :param stats: a batch_stats.BatchStats, charged for the hashing under email_hashing
+    """
+    recipients = iter(recipients)
+    source = SaltSource(block_size)
+    executor = ThreadPoolExecutor(threads) if threads > 1 else None
+    try:
+        while True:
+            block = list(itertools.islice(recipients, block_size))
+            if not block:
+                return
+            stats.lap('roster')
+            salts = source.salts(len(block))
+            hashed = hash_emails([recipient.identity for recipient in block], salts, executor, threads)
+            for recipient, salt, identity in zip(block, salts, hashed):
+                recipient.salted_identity = (salt, identity)
+            stats.lap('email_hashing')
+            for recipient in block:
+                yield recipient
+    finally:
+        if executor is not None:
+            executor.shutdown()
@@ -1,29 +1,197 @@
 #!/usr/bin/env python
 
-import os
+'''
+Writes a sorted "name : url" link file for a directory of v1.2, v2 or v3 certificates.
+
+Only the recipient name and certificate id are read from each certificate. They are picked out of the JSON
+token stream by ijson, a requirement of cert-tools, which stops as soon as both are found and never builds the
+(image heavy) document; if ijson can't be imported, the certificate is parsed with json instead. Files can be fanned out across a pool of processes.
+
+With a manifest file, the name and id found in each file are recorded along with its modification time and size,
+and later runs only open new or changed files. The manifest is kept sorted like the link file, so the unchanged
+entries are merged with the new ones in a single pass.
+'''
+import heapq
 import json
+import os
+import tempfile
 
 import configargparse
 
+from cert_core.cert_model.model import scope_name
+
+from cert_tools import helpers
+from cert_tools import parallel_helpers
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+V1_2_UID = 'assertion.uid'
+V1_2_GIVEN_NAME = 'recipient.givenName'
+V1_2_FAMILY_NAME = 'recipient.familyName'
+ID = 'id'
+V2_NAME = scope_name('recipientProfile') + '.name'
+V3_NAME = 'credentialSubject.name'
+V3_SUBJECT_ID = 'credentialSubject.id'
+FIELDS = (V1_2_UID, V1_2_GIVEN_NAME, V1_2_FAMILY_NAME, ID, V2_NAME, V3_NAME, V3_SUBJECT_ID)
+
+
+def get_link(fields):
+    """
+    Return (name, uid) from the FIELDS of a certificate, or None if they haven't all been found yet
+
+    - v1.2: recipient.givenName + familyName, assertion.uid
+    - v2: recipientProfile.name, id without its urn:uuid: prefix
+    - v3: credentialSubject.name (or credentialSubject.id if the certificate has no name), id
+    """
+    if V1_2_UID in fields:
+        if V1_2_GIVEN_NAME in fields and V1_2_FAMILY_NAME in fields:
+            return fields[V1_2_GIVEN_NAME] + ' ' + fields[V1_2_FAMILY_NAME], fields[V1_2_UID]
+        return None
+    if ID not in fields:
+        return None
+    uid = fields[ID]
+    if uid.startswith(helpers.URN_UUID_PREFIX):
+        uid = uid[len(helpers.URN_UUID_PREFIX):]
+    name = fields.get(V2_NAME) or fields.get(V3_NAME)
+    if name is None:
+        return None
+    return name, uid
+
+
+def get_fallback_link(fields):
+    """Like get_link, once the whole certificate has been read: a v3 certificate without a name uses its subject id"""
+    link = get_link(fields)
+    if link is None and ID in fields and V3_SUBJECT_ID in fields:
+        link = get_link(dict(fields, **{V3_NAME: fields[V3_SUBJECT_ID]}))
+    return link
+
+
+def read_fields_streaming(cert_file):
+    fields = {}
+    with open(cert_file, 'rb') as f:
+        for prefix, event, value in ijson.parse(f):
+            if event == 'string' and prefix in FIELDS:
+                fields[prefix] = value
+                if get_link(fields) is not None:
+                    break
+    return fields
+
+
+def read_fields(cert_file):
+    with open(cert_file) as f:
+        cert = json.load(f)
+    fields = {}
+    for field in FIELDS:
+        node = cert
+        for key in field.split('.'):
+            if not isinstance(node, dict) or key not in node:
+                break
+            node = node[key]
+        else:
+            if isinstance(node, str):
+                fields[field] = node
+    return fields
+
+
+def extract_link(cert_file):
+    """Return (name, uid) for CERT_FILE"""
+    fields = read_fields_streaming(cert_file) if ijson is not None else read_fields(cert_file)
+    link = get_fallback_link(fields)
+    if link is None:
+        raise Exception('could not find the recipient name and certificate id in ' + cert_file)
+    return link
+
+
+def _extract_chunk(cert_files):
+    return [extract_link(cert_file) for cert_file in cert_files]
+
+
+def iter_cert_entries(cert_path):
+    for entry in os.scandir(cert_path):
+        if entry.name.endswith('json') and entry.is_file():
+            yield entry
+
+
+def iter_cert_files(cert_path):
+    for entry in iter_cert_entries(cert_path):
+        yield entry.path
+
+
+def iter_links(cert_files, workers=1, chunk_size=100):
+    if workers > 1:
+        return parallel_helpers.imap_chunks(_extract_chunk, cert_files, workers, chunk_size)
+    return (extract_link(cert_file) for cert_file in cert_files)
+
+
+def write_atomically(output_file, lines):
+    """Write LINES to a temporary file next to OUTPUT_FILE, then move it into place"""
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        with os.fdopen(fd, 'w') as output:
+            output.writelines(lines)
+        os.replace(tmp_file, output_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def write_links(links, url_prefix, output_file):
+    """Write sorted LINKS, (name, uid) pairs, as name : url lines"""
+    write_atomically(output_file, ('{0} : {1}/{2}\n'.format(name, url_prefix, uid) for name, uid in links))
+
+
+def read_manifest(manifest_file):
+    """Return {file name: entry} for the manifest, in link order; empty if there is no manifest yet"""
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            for line in f:
+                entry = json.loads(line)
+                manifest[entry['file']] = entry
+    return manifest
+
+
+def manifest_sort_key(entry):
+    return entry['name'], entry['uid']
+
+
+def extract_links_incremental(cert_path, url_prefix, output_file, manifest_file, workers=1):
+    """
+    Like extract_links, but only opens the certificates that are not in MANIFEST_FILE or whose modification time
+    or size changed, then rewrites the link file and manifest
+    """
+    manifest = read_manifest(manifest_file)
+    unchanged = set()
+    changed = []
+    for entry in iter_cert_entries(cert_path):
+        st = entry.stat()
+        known = manifest.get(entry.name)
+        if known is not None and known['mtime_ns'] == st.st_mtime_ns and known['size'] == st.st_size:
+            unchanged.add(entry.name)
+        else:
+            changed.append((entry.name, st.st_mtime_ns, st.st_size))
+    print('{0} new or changed certificates, {1} unchanged'.format(len(changed), len(unchanged)))
 
-def extract_links(cert_path, url_prefix, output_file):
-    certs = [os.path.join(cert_path, f) for f in os.path.listdir(cert_path) if f.endswith('json')]
+    links = iter_links((os.path.join(cert_path, name) for name, _, _ in changed), workers)
+    new_entries = sorted(
+        ({'name': name, 'uid': uid, 'file': file_name, 'mtime_ns': mtime_ns, 'size': size}
+         for (file_name, mtime_ns, size), (name, uid) in zip(changed, links)),
+        key=manifest_sort_key)
+    # manifest entries are in link order already; deleted and changed files drop out
+    old_entries = (entry for entry in manifest.values() if entry['file'] in unchanged)
+    entries = list(heapq.merge(old_entries, new_entries, key=manifest_sort_key))
 
-    certs_dict = dict()
+    write_links(((entry['name'], entry['uid']) for entry in entries), url_prefix, output_file)
+    write_atomically(manifest_file, (json.dumps(entry) + '\n' for entry in entries))
 
-    for cert in certs:
-        with open(cert) as the_cert:
-            cert_str = the_cert.read()
-            a_cert = json.loads(cert_str)
-            print(a_cert)
-            certificate_uid = a_cert['assertion']['uid']
-            name = a_cert['recipient']['givenName'] + ' ' + a_cert['recipient']['familyName']
-            certs_dict[name] = certificate_uid
 
-    with open(output_file, 'w') as links:
-        for key in sorted(certs_dict.iterkeys()):
-            the_url = '{}/{}'.format(url_prefix, certs_dict[key])
-            links.write(key + ' : ' + the_url + '\n')
+def extract_links(cert_path, url_prefix, output_file, workers=1):
+    # only (name, uid) pairs are kept in memory, never whole certificates
+    links = sorted(iter_links(iter_cert_files(cert_path), workers))
+    write_links(links, url_prefix, output_file)
 
 
 def get_config():
@@ -36,6 +204,10 @@ def get_config():
                    help='URL prefix')
     p.add_argument('-o', '--output_path', type=str,
                    help='Path to output file')
+    p.add_argument('--workers', type=int, default=1,
+                   help='number of worker processes reading certificates')
+    p.add_argument('-m', '--manifest_file', type=str,
+                   help='record of the certificates already processed, so later runs only read new or changed files')
     args, _ = p.parse_known_args()
 
     return args
@@ -44,7 +216,10 @@ def get_config():
 def main():
     conf = get_config()
 
-    extract_links(conf.cert_path, conf.url_prefix, conf.output_path)
+    if conf.manifest_file:
+        extract_links_incremental(conf.cert_path, conf.url_prefix, conf.output_path, conf.manifest_file, conf.workers)
+    else:
+        extract_links(conf.cert_path, conf.url_prefix, conf.output_path, conf.workers)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,3 @@
-import base64
 import json
 import os
 import sys
@@ -7,6 +6,8 @@ from datetime import datetime, timezone
 import configargparse
 import pytz
 
+from cert_tools import image_cache
+
 if sys.version > '3':
     from urllib.parse import urljoin
 else:
@@ -14,7 +15,7 @@ else:
 
 BASE62 = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.join(__file__, os.pardir), os.pardir))
-png_prefix = 'data:image/png;base64,'
+png_prefix = image_cache.PNG_PREFIX
 URN_UUID_PREFIX = 'urn:uuid:'
 
 
@@ -28,10 +29,8 @@ def make_action(additional_arg):
 
 
 def encode_image(filename):
-    with open(filename, "rb") as image_file:
-        encoded = base64.b64encode(image_file.read())
-        png_str = png_prefix + encoded.decode('utf-8')
-        return png_str
+    """Return the PNG data URI of FILENAME, from the image_cache if it was already encoded"""
+    return image_cache.get_data_uri(filename)
 
 
 def urljoin_wrapper(part1, part2):
@@ -0,0 +1,146 @@
+'''
+Cache of base64 data URIs for the images embedded in templates and issuer profiles.
+
+The same logos and signatures are encoded again for every template build. Entries are keyed by the image's path,
+modification time and size, so an edited image is re-encoded. The in-process cache is an LRU bounded by the
+total length of the cached data URIs; the optional on-disk cache persists them across runs (one file per entry,
+also bounded, evicting the least recently used files).
+'''
+import base64
+import collections
+import hashlib
+import os
+import tempfile
+
+PNG_PREFIX = 'data:image/png;base64,'
+DEFAULT_MAX_BYTES = 64 << 20
+DEFAULT_MAX_DISK_BYTES = 256 << 20
+CACHE_FILE_SUFFIX = '.datauri'
+
+
+def encode_file(filename):
+    with open(filename, 'rb') as image_file:
+        return PNG_PREFIX + base64.b64encode(image_file.read()).decode('utf-8')
+
+
+class ImageCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, cache_dir=None, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        """
+        :param max_bytes: bound on the total length of the data URIs kept in memory
+        :param cache_dir: directory of the on-disk cache, or None to only cache in memory
+        :param max_disk_bytes: bound on the total size of the on-disk cache
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_data_uri(self, filename):
+        """Return the PNG data URI of FILENAME, encoding it only if it isn't cached or has changed"""
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+
+        data_uri = self.entries.get(key)
+        if data_uri is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data_uri
+
+        self.misses += 1
+        data_uri = self._read_disk(key)
+        if data_uri is None:
+            data_uri = encode_file(path)
+            self._write_disk(key, data_uri)
+        self._add(key, data_uri)
+        return data_uri
+
+    def _add(self, key, data_uri):
+        if len(data_uri) > self.max_bytes:
+            return
+        self.entries[key] = data_uri
+        self.size += len(data_uri)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha256('{0}\0{1}\0{2}'.format(*key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + CACHE_FILE_SUFFIX)
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        disk_path = self._disk_path(key)
+        try:
+            with open(disk_path) as cached:
+                data_uri = cached.read()
+        except (IOError, OSError):
+            return None
+        # the file's mtime records its last use for eviction
+        os.utime(disk_path, None)
+        return data_uri
+
+    def _write_disk(self, key, data_uri):
+        if not self.cache_dir or len(data_uri) > self.max_disk_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'w') as cached:
+            cached.write(data_uri)
+        # atomic, so concurrent template builds never read a partial entry
+        os.replace(tmp_path, self._disk_path(key))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(CACHE_FILE_SUFFIX):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self, disk=True):
+        """Empty the in-process cache, and the on-disk cache unless DISK is False"""
+        self.entries.clear()
+        self.size = 0
+        if disk and self.cache_dir and os.path.isdir(self.cache_dir):
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(CACHE_FILE_SUFFIX):
+                    os.remove(entry.path)
+
+
+_cache = ImageCache()
+
+
+def get_cache():
+    return _cache
+
+
+def configure(cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+    """Replace the process-wide cache used by helpers.encode_image, e.g. to enable the on-disk cache"""
+    global _cache
+    _cache = ImageCache(max_bytes, cache_dir, max_disk_bytes)
+    return _cache
+
+
+def get_data_uri(filename):
+    return _cache.get_data_uri(filename)
+
+
+def clear(disk=True):
+    _cache.clear(disk)
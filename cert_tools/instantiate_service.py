@@ -0,0 +1,223 @@
+'''
+Local HTTP service mode for the v2 and v3 instantiate tools.
+
+Enrollment systems that instantiate many small batches pay interpreter startup, template loading and schema
+compilation on every run. With --serve_port, instantiate-certificate-batch (or its _v2 variant) stays up instead
+and instantiates the roster rows posted to it. Templates (keyed by path and modification time), parsed jsonpaths
+and compiled schema validators stay warm between requests.
+
+    POST /instantiate  {"rows": [{"name": ..., "pubkey": ..., "identity": ..., <additional columns>}, ...],
+                        "template_file_name": <optional, in template_dir>, "persist": <optional, false>}
+    GET  /health
+    GET  /metrics
+
+Without persist, the certificates are returned as [{"uid": ..., "certificate": ...}] in row order. With persist,
+they are written to unsigned_certificates_dir and only their uids are returned. With the sequential
+filename_format, row numbers run on across requests, starting after the highest numbered certificate already in
+unsigned_certificates_dir, so requests never reuse each other's uids. At most max_concurrent_requests requests
+are served at a time; the others get a 503 right away, so callers can retry.
+'''
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+from cert_tools import json_serializer
+from cert_tools import jsonpath_helpers
+from cert_tools import output_sinks
+
+
+def add_service_arguments(p):
+    p.add_argument('--serve_port', type=int, help='run as a local HTTP service on this port instead of instantiating the roster')
+    p.add_argument('--serve_host', type=str, default='127.0.0.1', help='address the service listens on')
+    p.add_argument('--max_concurrent_requests', type=int, default=4, help='number of requests the service handles at a time')
+    p.add_argument('--max_request_rows', type=int, default=10000, help='largest number of roster rows accepted in a request')
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class TemplateCache:
+    """Parsed templates by path, read again only when the file's modification time or size changes"""
+    def __init__(self):
+        self.templates = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, template_file):
+        """Return the template in TEMPLATE_FILE; it is shared between requests and must not be modified"""
+        st = os.stat(template_file)
+        key = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            cached = self.templates.get(template_file)
+            if cached is not None and cached[0] == key:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        with open(template_file) as f:
+            template = json.load(f)
+        with self.lock:
+            self.templates[template_file] = (key, template)
+        return template
+
+
+class InstantiateService:
+    def __init__(self, config, module):
+        """
+        :param config: the instantiate tool's configuration; requests may only choose another template
+        :param module: instantiate_v2_certificate_batch or instantiate_v3_certificate_batch
+        """
+        self.config = config
+        self.module = module
+        self.templates = TemplateCache()
+        # certificates are returned and persisted in the layout the batch would write them in
+        self.serializer = json_serializer.get_serializer(config)
+        self.slots = threading.BoundedSemaphore(config.max_concurrent_requests)
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'rejected': 0, 'failed': 0, 'certificates': 0, 'in_flight': 0}
+        self.next_row = 0
+        output_dir = os.path.join(config.abs_data_dir, config.unsigned_certificates_dir)
+        if config.filename_format == 'sequential' and os.path.isdir(output_dir):
+            numbers = [int(uid) for uid in output_sinks.scan_existing_uids(output_dir) if uid.isdigit()]
+            self.next_row = max(numbers, default=-1) + 1
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] += n
+
+    def reserve_rows(self, count):
+        """Return the number of the first of COUNT rows, for sequential uids unique across requests"""
+        with self.lock:
+            start = self.next_row
+            self.next_row += count
+        return start
+
+    def get_template_file(self, template_file_name):
+        if os.path.basename(template_file_name) != template_file_name:
+            raise RequestError(400, 'template_file_name must be a file name in template_dir')
+        return os.path.join(self.config.abs_data_dir, self.config.template_dir, template_file_name)
+
+    def instantiate(self, request):
+        """Instantiate the rows of REQUEST, a decoded JSON object, and return the response object"""
+        if not isinstance(request, dict) or not isinstance(request.get('rows'), list):
+            raise RequestError(400, 'expected a JSON object with a list of rows')
+        rows = request['rows']
+        if len(rows) > self.config.max_request_rows:
+            raise RequestError(413, 'too many rows: {0}, at most {1} are accepted'.format(
+                len(rows), self.config.max_request_rows))
+
+        config = argparse.Namespace(**vars(self.config))
+        config.template_file_name = request.get('template_file_name') or self.config.template_file_name
+        try:
+            template = self.templates.get(self.get_template_file(config.template_file_name))
+        except (IOError, OSError):
+            raise RequestError(404, 'no template {0}'.format(config.template_file_name))
+
+        try:
+            # the whole batch is built and validated before anything is written
+            certs = list(self.module.iter_unsigned_certificates_from_rows(config, template, rows,
+                                                                          start=self.reserve_rows(len(rows))))
+        except KeyError as e:
+            raise RequestError(400, 'row is missing the column {0}'.format(e))
+        except Exception as e:
+            raise RequestError(400, 'could not instantiate the rows: {0}'.format(e))
+
+        if request.get('persist'):
+            output_dir = os.path.join(config.abs_data_dir, config.unsigned_certificates_dir)
+            with output_sinks.get_sink('directory', output_dir, no_clobber=config.no_clobber,
+                                       writer_threads=config.writer_threads, fsync=config.fsync,
+                                       serializer=self.serializer) as sink:
+                output_sinks.write_unsigned_certificates(certs, sink)
+            response = {'uids': [uid for uid, _ in certs], 'location': sink.location}
+        else:
+            response = {'certificates': [{'uid': uid, 'certificate': cert} for uid, cert in certs]}
+        self.count('certificates', len(certs))
+        return response
+
+    def get_metrics(self):
+        with self.lock:
+            metrics = dict(self.counters)
+        metrics['uptime_seconds'] = time.time() - self.started
+        metrics['template_cache'] = {'hits': self.templates.hits, 'misses': self.templates.misses,
+                                     'size': len(self.templates.templates)}
+        metrics['jsonpath_cache'] = jsonpath_helpers.parse_cache_info()
+        return metrics
+
+
+def make_server(config, module):
+    # http.server is only imported here, so the batch tools, which import this module, don't load it on every run
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class ServiceRequestHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, obj):
+            data = self.server.service.serializer.dumpb(obj)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            if status == 503:
+                self.send_header('Retry-After', '1')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self.send_json(200, {'status': 'ok'})
+            elif self.path == '/metrics':
+                self.send_json(200, self.server.service.get_metrics())
+            else:
+                self.send_json(404, {'error': 'unknown path ' + self.path})
+
+        def do_POST(self):
+            if self.path != '/instantiate':
+                self.send_json(404, {'error': 'unknown path ' + self.path})
+                return
+            service = self.server.service
+            if not service.slots.acquire(blocking=False):
+                service.count('rejected')
+                self.send_json(503, {'error': 'too many concurrent requests'})
+                return
+            service.count('requests')
+            service.count('in_flight')
+            try:
+                try:
+                    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                    request = json.loads(body.decode('utf-8'))
+                except ValueError:
+                    raise RequestError(400, 'the request body is not valid JSON')
+                status, response = 200, service.instantiate(request)
+            except RequestError as e:
+                service.count('failed')
+                status, response = e.status, {'error': str(e)}
+            except Exception as e:
+                logging.exception('request failed')
+                service.count('failed')
+                status, response = 500, {'error': str(e)}
+            finally:
+                service.count('in_flight', -1)
+                service.slots.release()
+            self.send_json(status, response)
+
+    server = ThreadingHTTPServer((config.serve_host, config.serve_port), ServiceRequestHandler)
+    server.daemon_threads = True
+    server.service = InstantiateService(config, module)
+    # fail at startup rather than on the first request if the default template is missing
+    server.service.templates.get(server.service.get_template_file(config.template_file_name))
+    return server
+
+
+def serve(config, module):
+    server = make_server(config, module)
+    print('Serving on http://{0}:{1}'.format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
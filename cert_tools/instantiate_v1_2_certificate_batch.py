@@ -4,23 +4,32 @@
 Merges a certificate template with recipients defined in a roster file. The result is
 unsigned certificates that can be given to cert-issuer.
 '''
-import copy
-import csv
-import hashlib
 import json
 import os
+import re
 import uuid
 from datetime import date
 
 import configargparse
 
-from cert_schema import schema_validator
-
+from cert_tools import batch_stats
+from cert_tools import email_hashing
 from cert_tools import helpers
 from cert_tools import jsonpath_helpers
+from cert_tools import json_serializer
+from cert_tools import output_sinks
+from cert_tools import roster_helpers
+from cert_tools import template_helpers
+from cert_tools import validation_helpers
+
+
+ROSTER_COLUMNS = ['givenName', 'familyName', 'pubkey', 'identity']
+PUBKEY_PATTERN = re.compile(r'^(ecdsa-koblitz-pubkey:)?[A-Za-z0-9]{25,90}$')
 
 
 class Recipient:
+    __slots__ = ('given_name', 'family_name', 'pubkey', 'identity', 'additional_fields', 'salted_identity')
+
     def __init__(self, fields):
         self.family_name = fields['familyName']
         self.given_name = fields['givenName']
@@ -33,10 +42,18 @@ class Recipient:
         fields.pop('identity', None)
 
         self.additional_fields = fields
+        # (salt, hashed identity), set by email_hashing.iter_salted_recipients
+        self.salted_identity = None
 
-
-def hash_and_salt_email_address(email, salt):
-    return 'sha256$' + hashlib.sha256(email + salt).hexdigest()
+    @classmethod
+    def from_row(cls, columns, row):
+        """Build a recipient straight from a csv.reader ROW, without a dict, given the roster's COLUMNS"""
+        recipient = cls.__new__(cls)
+        recipient.given_name, recipient.family_name, recipient.pubkey, recipient.identity = \
+            [row[i] for i in columns.required]
+        recipient.additional_fields = roster_helpers.AdditionalFields(columns, row)
+        recipient.salted_identity = None
+        return recipient
 
 
 def instantiate_assertion(config, cert, uid, issued_on):
@@ -46,14 +63,16 @@ def instantiate_assertion(config, cert, uid, issued_on):
     return cert
 
 
-def instantiate_recipient(config, cert, recipient):
+def instantiate_recipient(config, cert, recipient, stats=batch_stats.NULL_STATS):
     cert['recipient']['givenName'] = recipient.given_name
     cert['recipient']['familyName'] = recipient.family_name
     cert['recipient']['publicKey'] = recipient.pubkey
+    stats.lap('recipient')
     if config.hash_emails:
-        salt = helpers.encode(os.urandom(16))
+        salt, identity = recipient.salted_identity or email_hashing.salt_and_hash(recipient.identity)
         cert['recipient']['salt'] = salt
-        cert['recipient']['identity'] = hash_and_salt_email_address(recipient.identity, salt)
+        cert['recipient']['identity'] = identity
+        stats.lap('email_hashing')
     else:
         cert['recipient']['identity'] = recipient.identity
 
@@ -67,38 +86,87 @@ def instantiate_recipient(config, cert, recipient):
             # throw an exception on this in case it's a user error. We may decide to remove this if it's a nuisance
             raise Exception(
                 'there are fields in the csv file that are not expected by the additional_per_recipient_fields configuration')
+    stats.lap('jsonpath')
 
 
-def create_unsigned_certificates_from_roster(config):
-    roster = os.path.join(config.abs_data_dir, config.roster)
-    template = os.path.join(config.abs_data_dir, config.template_dir, config.template_file_name)
+def get_per_recipient_paths(additional_fields):
+    """jsonpaths of the template nodes that change for every recipient"""
+    paths = ['$.assertion', '$.recipient']
+    if additional_fields:
+        paths.extend(field['path'] for field in additional_fields)
+    return paths
+
+
+def iter_unsigned_certificates_from_roster(config, template, recipients, stats=None):
+    """
+    Lazily builds and validates one certificate per recipient, yielding (uid, cert) pairs in roster order.
+    A batch_stats.BatchStats passed as STATS collects the time spent in each stage.
+    """
+    if stats is None:
+        stats = batch_stats.NULL_STATS
     issued_on = str(date.today())
-    output_dir = os.path.join(config.abs_data_dir, config.unsigned_certificates_dir)
+    compiled_template = template_helpers.CompiledTemplate(template, get_per_recipient_paths(config.additional_per_recipient_fields))
+    if config.hash_emails:
+        recipients = email_hashing.iter_salted_recipients(recipients, config.hash_threads, stats=stats)
 
-    recipients = []
-    with open(roster, 'r') as theFile:
-        reader = csv.DictReader(theFile)
-        for line in reader:
-            r = Recipient(line)
-            recipients.append(r)
+    stats.start_row()
+    for recipient in recipients:
+        stats.lap('roster')
+        uid = str(uuid.uuid4())
+        stats.lap('uid')
 
+        cert = compiled_template.instantiate()
+        stats.lap('copy')
+
+        instantiate_assertion(config, cert, uid, issued_on)
+        instantiate_recipient(config, cert, recipient, stats)
+
+        # validate certificate before writing
+        validation_helpers.validate_unsigned_v1_2(cert)
+        stats.lap('validation')
+        stats.end_row()
+
+        yield uid, cert
+        stats.start_row()
+
+
+def get_recipients_from_roster(config):
+    roster = os.path.join(config.abs_data_dir, config.roster)
+    for columns, row in roster_helpers.iter_roster_rows(roster, ROSTER_COLUMNS):
+        yield Recipient.from_row(columns, row)
+
+
+def get_template(config):
+    template = os.path.join(config.abs_data_dir, config.template_dir, config.template_file_name)
     with open(template) as template:
         cert_str = template.read()
-        template = json.loads(cert_str)
+        return json.loads(cert_str)
 
-        for recipient in recipients:
-            uid = str(uuid.uuid4())
 
-            cert = copy.deepcopy(template)
+def create_unsigned_certificates_from_roster(config):
+    output_dir = os.path.join(config.abs_data_dir, config.unsigned_certificates_dir)
+
+    if config.preflight:
+        # report every bad row before any certificate is built
+        roster_helpers.check_roster(os.path.join(config.abs_data_dir, config.roster), ROSTER_COLUMNS,
+                                    config.additional_per_recipient_fields, PUBKEY_PATTERN)
 
-            instantiate_assertion(config, cert, uid, issued_on)
-            instantiate_recipient(config, cert, recipient)
+    stats = batch_stats.get_batch_stats(config)
+    recipients = get_recipients_from_roster(config)
+    template = get_template(config)
 
-            # validate certificate before writing
-            schema_validator.validate_unsigned_v1_2(cert)
+    certs = iter_unsigned_certificates_from_roster(config, template, recipients, stats)
+    if not config.streaming:
+        # build and validate the whole batch before writing anything
+        certs = dict(certs).items()
+    with output_sinks.get_sink(config.output_sink, output_dir, config.output_archive,
+                               writer_threads=config.writer_threads, fsync=config.fsync,
+                               serializer=json_serializer.get_serializer(config)) as sink:
+        print('Writing certificates to ' + sink.location)
+        output_sinks.write_unsigned_certificates(certs, sink, stats=stats)
 
-            with open(os.path.join(output_dir, uid + '.json'), 'w') as unsigned_cert:
-                json.dump(cert, unsigned_cert)
+    if stats is not None:
+        stats.report(config.stats_file and os.path.join(config.abs_data_dir, config.stats_file))
 
 
 def get_config():
@@ -111,9 +179,20 @@ def get_config():
     p.add_argument('--template_file_name', type=str, help='the template file name')
     p.add_argument('--hash_emails', action='store_true',
                    help='whether to hash emails in the certificate')
+    p.add_argument('--hash_threads', type=int, default=1,
+                   help='with hash_emails, number of threads hashing each block of emails')
     p.add_argument('--additional_per_recipient_fields', action=helpers.make_action('per_recipient_fields'), help='additional per-recipient fields')
     p.add_argument('--unsigned_certificates_dir', type=str, help='output directory for unsigned certificates')
     p.add_argument('--roster', type=str, help='roster file name')
+    p.add_argument('--preflight', action='store_true', help='check the whole roster for problems before instantiating any certificate')
+    p.add_argument('--streaming', action='store_true', help='write each certificate as soon as it is built instead of after the whole roster is processed')
+    p.add_argument('--output_sink', type=str, default='directory', choices=output_sinks.SINK_TYPES, help='where to write unsigned certificates (one of directory, jsonl, tar or zip)')
+    p.add_argument('--output_archive', type=str, help='file name of the jsonl, tar or zip output in unsigned_certificates_dir')
+    p.add_argument('--writer_threads', type=int, default=0, help='number of background threads writing certificate files (directory output only); 0 writes them in the main loop')
+    p.add_argument('--fsync', action='store_true', help='sync certificate files and their directory to disk, in batches, before they count as written')
+    p.add_argument('--stats', action='store_true', help='print the time spent in each stage, row latency, throughput and peak memory')
+    p.add_argument('--stats_file', type=str, help='write the stats as JSON to this file, relative to data_dir, instead of printing them')
+    json_serializer.add_serializer_arguments(p)
     args, _ = p.parse_known_args()
     args.abs_data_dir = os.path.abspath(os.path.join(cwd, args.data_dir))
 
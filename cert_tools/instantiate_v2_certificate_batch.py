@@ -4,33 +4,57 @@
 Merges a certificate template with recipients defined in a roster file. The result is
 unsigned certificates that can be given to cert-issuer.
 '''
-import copy
-import csv
-import hashlib
 import json
 import os
-import uuid
+import re
+import sys
 
 import configargparse
 
 from cert_core.cert_model.model import scope_name
-from cert_schema import schema_validator
 
+from cert_tools import batch_stats
+from cert_tools import checkpoint
+from cert_tools import email_hashing
 from cert_tools import helpers
+from cert_tools import instantiate_service
+from cert_tools import json_serializer
 from cert_tools import jsonpath_helpers
+from cert_tools import output_sinks
+from cert_tools import parallel_helpers
+from cert_tools import roster_helpers
+from cert_tools import template_helpers
+from cert_tools import uid_strategies
+from cert_tools import validation_helpers
+
+
+ROSTER_COLUMNS = ['name', 'pubkey', 'identity']
+PUBKEY_PATTERN = re.compile(r'^ecdsa-koblitz-pubkey:[A-Za-z0-9]{25,90}$')
 
 
 class Recipient:
+    __slots__ = ('name', 'pubkey', 'identity', 'additional_fields', 'uid', 'salted_identity')
+
     def __init__(self, fields):
         self.name = fields.pop('name')
         self.pubkey = fields.pop('pubkey')
         self.identity = fields.pop('identity')
 
         self.additional_fields = fields
-
-
-def hash_and_salt_email_address(email, salt):
-    return 'sha256$' + hashlib.sha256(email + salt).hexdigest()
+        # assigned by uid_strategies.assign_uids, or by the instantiate loop if None
+        self.uid = None
+        # (salt, hashed identity), set by email_hashing.iter_salted_recipients
+        self.salted_identity = None
+
+    @classmethod
+    def from_row(cls, columns, row):
+        """Build a recipient straight from a csv.reader ROW, without a dict, given the roster's COLUMNS"""
+        recipient = cls.__new__(cls)
+        recipient.name, recipient.pubkey, recipient.identity = [row[i] for i in columns.required]
+        recipient.additional_fields = roster_helpers.AdditionalFields(columns, row)
+        recipient.uid = None
+        recipient.salted_identity = None
+        return recipient
 
 
 def instantiate_assertion(cert, uid, issued_on):
@@ -39,13 +63,14 @@ def instantiate_assertion(cert, uid, issued_on):
     return cert
 
 
-def instantiate_recipient(cert, recipient, additional_fields, hash_emails):
+def instantiate_recipient(cert, recipient, additional_fields, hash_emails, stats=batch_stats.NULL_STATS):
 
     if hash_emails:
-        salt = helpers.encode(os.urandom(16))
+        salt, identity = recipient.salted_identity or email_hashing.salt_and_hash(recipient.identity)
         cert['recipient']['hashed'] = True
         cert['recipient']['salt'] = salt
-        cert['recipient']['identity'] = hash_and_salt_email_address(recipient.identity, salt)
+        cert['recipient']['identity'] = identity
+        stats.lap('email_hashing')
     else:
         cert['recipient']['identity'] = recipient.identity
         cert['recipient']['hashed'] = False
@@ -56,6 +81,7 @@ def instantiate_recipient(cert, recipient, additional_fields, hash_emails):
     cert[profile_field]['type'] = ['RecipientProfile', 'Extension']
     cert[profile_field]['name'] = recipient.name
     cert[profile_field]['publicKey'] = recipient.pubkey
+    stats.lap('recipient')
 
     if additional_fields:
         if not recipient.additional_fields:
@@ -67,37 +93,108 @@ def instantiate_recipient(cert, recipient, additional_fields, hash_emails):
             # throw an exception on this in case it's a user error. We may decide to remove this if it's a nuisance
             raise Exception(
                 'there are fields that are not expected by the additional_per_recipient_fields configuration')
+    stats.lap('jsonpath')
 
 
-def create_unsigned_certificates_from_roster(template, recipients, use_identities, additionalFields, hash_emails):
-    issued_on = helpers.create_iso8601_tz()
+def get_per_recipient_paths(additional_fields):
+    """jsonpaths of the template nodes that change for every recipient"""
+    paths = ['$.id', '$.issuedOn', '$.recipient', '$.' + scope_name('recipientProfile')]
+    if additional_fields:
+        paths.extend(field['path'] for field in additional_fields)
+    return paths
+
+
+def get_uid_allocator(template, filename_format, start=0):
+    """The uid strategy selected by FILENAME_FORMAT; identities are prefixed with the badge name, uuid5 names are
+    scoped to the badge"""
+    return uid_strategies.UidAllocator(filename_format, prefix=template['badge']['name'],
+                                       namespace=template['badge'].get('id'), start=start)
+
+
+def iter_unsigned_certificates_from_roster(template, recipients, use_identities, additionalFields, hash_emails, issued_on=None, validate=None, skip_uids=None, stats=None, allocator=None, hash_threads=1):
+    """
+    Lazily builds and validates one certificate per recipient, yielding (uid, cert) pairs in roster order.
+    Nothing is held back, so memory stays flat when RECIPIENTS is itself a lazy iterator.
+
+    Recipients without a uid get one from ALLOCATOR, by default uuid4 or, with USE_IDENTITIES, certname_identity.
+    Rows whose uid is in SKIP_UIDS are not instantiated and yield (uid, None), so there is still one pair per row.
+    With HASH_EMAILS, identities are hashed in blocks on HASH_THREADS threads.
+    A batch_stats.BatchStats passed as STATS collects the time spent in each stage.
+    """
+    if issued_on is None:
+        issued_on = helpers.create_iso8601_tz()
+    if validate is None:
+        validate = validate_unsigned_certificate
+    if stats is None:
+        stats = batch_stats.NULL_STATS
+    if allocator is None:
+        allocator = get_uid_allocator(template, 'certname_identity' if use_identities else 'uuid')
+    compiled_template = template_helpers.CompiledTemplate(template, get_per_recipient_paths(additionalFields))
+    if hash_emails:
+        recipients = email_hashing.iter_salted_recipients(recipients, hash_threads, stats=stats)
 
-    certs = {}
+    stats.start_row()
     for recipient in recipients:
-        if use_identities:
-            uid = template['badge']['name'] + recipient.identity
-            uid = "".join(c for c in uid if c.isalnum())
-        else:
-            uid = str(uuid.uuid4())
+        stats.lap('roster')
+        uid = recipient.uid
+        if uid is None:
+            uid = allocator.allocate(recipient.identity)
+
+        if skip_uids is not None and uid in skip_uids:
+            yield uid, None
+            stats.start_row()
+            continue
+        stats.lap('uid')
 
-        cert = copy.deepcopy(template)
+        cert = compiled_template.instantiate()
+        stats.lap('copy')
 
         instantiate_assertion(cert, uid, issued_on)
-        instantiate_recipient(cert, recipient, additionalFields, hash_emails)
+        instantiate_recipient(cert, recipient, additionalFields, hash_emails, stats)
 
         # validate certificate before writing
-        schema_validator.validate_v2(cert)
+        validate(cert)
+        stats.lap('validation')
+        stats.end_row()
+
+        yield uid, cert
+        stats.start_row()
+
+
+def create_unsigned_certificates_from_roster(template, recipients, use_identities, additionalFields, hash_emails):
+    return dict(iter_unsigned_certificates_from_roster(template, recipients, use_identities, additionalFields, hash_emails))
+
+
+def iter_unsigned_certificates_from_rows(config, template, rows, issued_on=None, start=0):
+    """
+    Instantiate ROWS, dicts of roster columns such as those posted to the instantiate_service. With the sequential
+    filename_format, the first row gets the uid START
+    """
+    recipients = [Recipient(dict(row)) for row in rows]
+    allocator = get_uid_allocator(template, config.filename_format, start)
+    return iter_unsigned_certificates_from_roster(template, recipients, False, config.additional_per_recipient_fields,
+                                                  config.hash_emails, issued_on, get_certificate_validator(config),
+                                                  allocator=allocator, hash_threads=config.hash_threads)
+
+
+def validate_unsigned_certificate(cert):
+    return validation_helpers.validate_v2(cert)
 
-        certs[uid] = cert
-    return certs
 
+def get_certificate_validator(config):
+    if config.fragment_validation:
+        paths = get_per_recipient_paths(config.additional_per_recipient_fields)
+        from cert_schema import schema_validator
+        return validation_helpers.FragmentValidator(schema_validator.SCHEMA_FILE_V2_0, paths,
+                                                    full_validation_every=config.full_validation_every)
+    return validate_unsigned_certificate
 
-def get_recipients_from_roster(config):
+
+def get_recipients_from_roster(config, start_row=0):
+    """Yield the recipients of the roster from row START_ROW on, as they are read"""
     roster = os.path.join(config.abs_data_dir, config.roster)
-    with open(roster, 'r') as theFile:
-        reader = csv.DictReader(theFile)
-        recipients = map(lambda x: Recipient(x), reader)
-        return list(recipients)
+    for columns, row in roster_helpers.iter_roster_rows(roster, ROSTER_COLUMNS, start_row):
+        yield Recipient.from_row(columns, row)
 
 
 def get_template(config):
@@ -107,21 +204,106 @@ def get_template(config):
         return json.loads(cert_str)
 
 
+# per-process state of a --workers pool; each worker loads the template once
+_worker_state = {}
+
+
+def _init_worker(config, issued_on, skip_uids):
+    _worker_state['config'] = config
+    _worker_state['template'] = get_template(config)
+    _worker_state['issued_on'] = issued_on
+    _worker_state['skip_uids'] = skip_uids
+    _worker_state['validate'] = get_certificate_validator(config)
+
+
+def _instantiate_chunk(recipients, stats=None):
+    config = _worker_state['config']
+    use_identities = config.filename_format == "certname_identity"
+    certs = iter_unsigned_certificates_from_roster(_worker_state['template'], recipients, use_identities, config.additional_per_recipient_fields, config.hash_emails,
+                                                   _worker_state['issued_on'], _worker_state['validate'], _worker_state['skip_uids'], stats,
+                                                   hash_threads=config.hash_threads)
+    return list(certs)
+
+
+def _instantiate_chunk_with_stats(recipients):
+    stats = batch_stats.BatchStats()
+    return _instantiate_chunk(recipients, stats), stats.to_dict()
+
+
 def instantiate_batch(config):
     recipients = get_recipients_from_roster(config)
     template = get_template(config)
-    use_identities = config.filename_format == "certname_identity"
-    certs = create_unsigned_certificates_from_roster(template, recipients, use_identities, config.additional_per_recipient_fields, config.hash_emails)
     output_dir = os.path.join(config.abs_data_dir, config.unsigned_certificates_dir)
-    print('Writing certificates to ' + output_dir)
+    issued_on = helpers.create_iso8601_tz()
 
-    for uid in certs.keys():
-        cert_file = os.path.join(output_dir, uid + '.json')
-        if os.path.isfile(cert_file) and config.no_clobber:
-            continue
+    if config.preflight:
+        # report every bad row before any certificate is built
+        preflight_allocator = get_uid_allocator(template, config.filename_format)
+        uid_for_identity = preflight_allocator.identity_uid if preflight_allocator.identity_based else None
+        roster_helpers.check_roster(os.path.join(config.abs_data_dir, config.roster), ROSTER_COLUMNS,
+                                    config.additional_per_recipient_fields, PUBKEY_PATTERN, uid_for_identity)
+
+    journal = None
+    if config.checkpoint_file:
+        roster = os.path.join(config.abs_data_dir, config.roster)
+        journal = checkpoint.CheckpointJournal(os.path.join(config.abs_data_dir, config.checkpoint_file), roster,
+                                               issued_on, config.resume)
+        issued_on = journal.issued_on
+        if journal.start_row:
+            print('Resuming batch at roster row {0}'.format(journal.start_row))
+            # finished rows are skipped by the csv reader, without building their recipients
+            recipients = get_recipients_from_roster(config, journal.start_row)
+
+    allocator = get_uid_allocator(template, config.filename_format, start=journal.start_row if journal else 0)
+    if journal is not None:
+        # collisions resolve as they did before the interruption
+        allocator.reserve(journal.uids.values())
+    # uids are given out here, in roster order, even when rows are instantiated by workers; rows journaled but not
+    # committed by an interrupted run keep their uid, so their certificates are rewritten rather than duplicated
+    if journal is not None:
+        recipients = uid_strategies.assign_uids(recipients, allocator, journal.uids, journal.start_row)
+    else:
+        recipients = uid_strategies.assign_uids(recipients, allocator)
+
+    existing_uids = None
+    if config.no_clobber and output_sinks.is_directory_sink(config.output_sink):
+        # one directory scan instead of a stat per certificate; with uuid file names rows can't match existing files
+        existing_uids = output_sinks.scan_existing_uids(output_dir)
+    skip_uids = existing_uids if allocator.deterministic else None
+
+    stats = batch_stats.get_batch_stats(config)
+    if config.workers > 1:
+        # roster chunks are fanned out to the pool and results come back in roster order
+        if stats is None:
+            certs = parallel_helpers.imap_chunks(_instantiate_chunk, recipients, config.workers, config.chunk_size,
+                                                 _init_worker, (config, issued_on, skip_uids))
+        else:
+            recipients = stats.timed_iter('roster', recipients)
+            certs = parallel_helpers.imap_chunks(_instantiate_chunk_with_stats, recipients, config.workers,
+                                                 config.chunk_size, _init_worker, (config, issued_on, skip_uids),
+                                                 merge=stats.merge)
+    else:
+        certs = iter_unsigned_certificates_from_roster(template, recipients, allocator.strategy == "certname_identity", config.additional_per_recipient_fields, config.hash_emails, issued_on,
+                                                       get_certificate_validator(config), skip_uids, stats, allocator,
+                                                       config.hash_threads)
+
+    if not config.streaming and journal is None:
+        # build and validate the whole batch before writing anything
+        certs = dict(certs).items()
+
+    append = journal is not None and journal.start_row > 0
+    try:
+        with output_sinks.get_sink(config.output_sink, output_dir, config.output_archive, config.no_clobber, append,
+                                   existing_uids, config.writer_threads, config.fsync,
+                                   json_serializer.get_serializer(config), journal.offset if append else None) as sink:
+            print('Writing certificates to ' + sink.location)
+            output_sinks.write_unsigned_certificates(certs, sink, journal, stats)
+    finally:
+        if journal is not None:
+            journal.close()
 
-        with open(cert_file, 'w') as unsigned_cert:
-            json.dump(certs[uid], unsigned_cert)
+    if stats is not None:
+        stats.report(config.stats_file and os.path.join(config.abs_data_dir, config.stats_file))
 
 
 def get_config():
@@ -134,11 +316,29 @@ def get_config():
     p.add_argument('--template_file_name', type=str, help='the template file name')
     p.add_argument('--hash_emails', action='store_true',
                    help='whether to hash emails in the certificate')
+    p.add_argument('--hash_threads', type=int, default=1,
+                   help='with hash_emails, number of threads hashing each block of emails')
     p.add_argument('--additional_per_recipient_fields', action=helpers.make_action('per_recipient_fields'), help='additional per-recipient fields')
     p.add_argument('--unsigned_certificates_dir', type=str, help='output directory for unsigned certificates')
     p.add_argument('--roster', type=str, help='roster file name')
-    p.add_argument('--filename_format', type=str, help='how to format certificate filenames (one of certname_identity or uuid)')
+    p.add_argument('--filename_format', type=str, choices=uid_strategies.STRATEGIES, help='how to format certificate filenames (one of uuid, certname_identity, uuid5_identity or sequential)')
     p.add_argument('--no_clobber', action='store_true', help='whether to overwrite existing certificates')
+    p.add_argument('--preflight', action='store_true', help='check the whole roster for problems before instantiating any certificate')
+    p.add_argument('--streaming', action='store_true', help='write each certificate as soon as it is built instead of after the whole roster is processed')
+    p.add_argument('--workers', type=int, default=1, help='number of worker processes used to instantiate certificates')
+    p.add_argument('--chunk_size', type=int, default=1000, help='number of roster rows handed to a worker at a time')
+    p.add_argument('--fragment_validation', action='store_true', help='validate the first certificate in full, then only the per-recipient fields of the others')
+    p.add_argument('--full_validation_every', type=int, default=0, help='with fragment_validation, also validate every Nth certificate in full')
+    p.add_argument('--output_sink', type=str, default='directory', choices=output_sinks.SINK_TYPES, help='where to write unsigned certificates (one of directory, jsonl, tar or zip)')
+    p.add_argument('--output_archive', type=str, help='file name of the jsonl, tar or zip output in unsigned_certificates_dir')
+    p.add_argument('--writer_threads', type=int, default=0, help='number of background threads writing certificate files (directory output only); 0 writes them in the main loop')
+    p.add_argument('--fsync', action='store_true', help='sync certificate files and their directory to disk, in batches, before they count as written')
+    p.add_argument('--checkpoint_file', type=str, help='journal of finished roster rows, relative to data_dir; implies streaming')
+    p.add_argument('--resume', action='store_true', help='continue an interrupted batch from its checkpoint_file')
+    p.add_argument('--stats', action='store_true', help='print the time spent in each stage, row latency, throughput and peak memory')
+    p.add_argument('--stats_file', type=str, help='write the stats as JSON to this file, relative to data_dir, instead of printing them')
+    json_serializer.add_serializer_arguments(p)
+    instantiate_service.add_service_arguments(p)
     args, _ = p.parse_known_args()
     args.abs_data_dir = os.path.abspath(os.path.join(cwd, args.data_dir))
 
@@ -147,6 +347,9 @@ def get_config():
 
 def main():
     conf = get_config()
+    if conf.serve_port:
+        instantiate_service.serve(conf, sys.modules[__name__])
+        return
     instantiate_batch(conf)
     print('Instantiated batch!')
 
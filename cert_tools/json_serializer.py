@@ -0,0 +1,153 @@
+'''
+Serialization of certificates and templates.
+
+By default certificates are written as before, by the standard library with its default separators. With
+--compact_json they are written without whitespace and with non-ASCII characters as UTF-8 rather than \\u escapes,
+by orjson or ujson when installed (--json_backend picks one), falling back to the standard library otherwise.
+Object keys keep their insertion order in every backend.
+
+Compact output is the same, byte for byte, whatever the backend. orjson's spelling is the reference. The only
+values the others spell differently are floats written with an exponent (1e16 rather than 1e+16, 1e-7 rather
+than 1e-07) and NaN or infinite floats, which are written as null; certificates holding such floats (rare, since
+certificates are mostly strings) are written by the standard library's Python encoder with orjson's float
+format. Objects a fast backend cannot serialize (such as integers beyond 64 bits or non-string keys) are handed
+to the standard library too.
+'''
+import json
+import json.encoder
+import math
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+BACKENDS = ['auto', 'orjson', 'ujson', 'json']
+
+_COMPACT_ENCODER = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def add_serializer_arguments(p):
+    p.add_argument('--compact_json', action='store_true', help='write JSON without whitespace and with UTF-8 rather than escaped characters')
+    p.add_argument('--json_backend', type=str, default='auto', choices=BACKENDS, help='library writing compact JSON; auto picks orjson, then ujson, then the standard library')
+
+
+def is_plain_float(value):
+    """Whether every backend writes the float VALUE the same way"""
+    return math.isfinite(value) and 'e' not in repr(value)
+
+
+def has_special_floats(obj):
+    """Whether OBJ holds a float that is not is_plain_float; walks the values, not the serialized text"""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, float) and not is_plain_float(value):
+            return True
+    return False
+
+
+def format_float(value):
+    """Return VALUE as orjson writes it"""
+    if not math.isfinite(value):
+        return 'null'
+    text = repr(value)
+    if 'e' in text:
+        mantissa, exponent = text.split('e')
+        return '{0}e{1}'.format(mantissa, int(exponent))
+    return text
+
+
+def _dumps_json(obj):
+    if not has_special_floats(obj):
+        return _COMPACT_ENCODER.encode(obj)
+    # the C encoder always formats floats with repr; the Python one takes a float formatter
+    iterencode = json.encoder._make_iterencode(
+        {}, _COMPACT_ENCODER.default, json.encoder.encode_basestring, None, format_float, ':', ',', False, False,
+        True)
+    return ''.join(iterencode(obj, 0))
+
+
+def _dumps_ujson(obj):
+    if has_special_floats(obj):
+        return _dumps_json(obj)
+    try:
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+    except (TypeError, ValueError, OverflowError):
+        return _dumps_json(obj)
+
+
+def get_backend(backend='auto'):
+    """Return the name of the installed library selected by BACKEND"""
+    if backend == 'auto':
+        if orjson is not None:
+            return 'orjson'
+        if ujson is not None:
+            return 'ujson'
+        return 'json'
+    if backend not in BACKENDS:
+        raise Exception('unknown JSON backend {0}; expected one of {1}'.format(backend, ', '.join(BACKENDS)))
+    if (backend == 'orjson' and orjson is None) or (backend == 'ujson' and ujson is None):
+        raise Exception('JSON backend {0} is not installed'.format(backend))
+    return backend
+
+
+class JsonSerializer:
+    def __init__(self, backend='auto', compact=False):
+        """
+        :param backend: one of BACKENDS; only used for compact output, the default layout is always written by the
+            standard library
+        :param compact: write without whitespace, with non-ASCII characters as UTF-8
+        """
+        self.compact = compact
+        self.backend = get_backend(backend) if compact else 'json'
+
+    def dumpb(self, obj):
+        """Return OBJ serialized as UTF-8 encoded bytes"""
+        if not self.compact:
+            return json.dumps(obj).encode('utf-8')
+        if self.backend == 'orjson':
+            try:
+                return orjson.dumps(obj)
+            except TypeError:
+                pass
+        elif self.backend == 'ujson':
+            return _dumps_ujson(obj).encode('utf-8')
+        return _dumps_json(obj).encode('utf-8')
+
+    def dumps(self, obj):
+        """Return OBJ serialized as text"""
+        if not self.compact:
+            return json.dumps(obj)
+        if self.backend == 'orjson':
+            return self.dumpb(obj).decode('utf-8')
+        if self.backend == 'ujson':
+            return _dumps_ujson(obj)
+        return _dumps_json(obj)
+
+    def dump_file(self, obj, path):
+        """Write OBJ to the file PATH"""
+        with open(path, 'wb') as f:
+            f.write(self.dumpb(obj))
+
+
+DEFAULT = JsonSerializer()
+
+
+def get_serializer(config):
+    """
+    Return the serializer selected by the compact_json and json_backend options of CONFIG; configurations built
+    without them get the default layout
+    """
+    if not getattr(config, 'compact_json', False):
+        return DEFAULT
+    return JsonSerializer(getattr(config, 'json_backend', 'auto'), compact=True)
@@ -1,10 +1,138 @@
-from jsonpath_rw import parse, Root, Child, Fields
+import logging
+import os
+
+# jsonpath_rw (and its PLY grammar) is only imported once a path is parsed, so the scripts start fast
+_jsonpath = None
+_parser = None
+
+# the PLY-based parser is slow and the set of paths is fixed by configuration, so each path is parsed once
+_parsed_paths = {}
+_compiled_paths = {}
+_parse_stats = {'hits': 0, 'misses': 0}
+
+
+def get_jsonpath():
+    """Return the jsonpath_rw.jsonpath module, importing it on first use"""
+    global _jsonpath
+    if _jsonpath is None:
+        from jsonpath_rw import jsonpath
+        _jsonpath = jsonpath
+    return _jsonpath
+
+
+def get_tables_file():
+    """Return the path of the cached PLY tables of the jsonpath grammar, or None if no cache directory is usable"""
+    import jsonpath_rw
+    import ply
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    directory = os.path.join(cache_home, 'cert-tools')
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return None
+    return os.path.join(directory, 'jsonpath_rw-{0}-ply-{1}-parsetab.pickle'.format(jsonpath_rw.__version__,
+                                                                                   ply.__version__))
+
+
+def build_yacc_parser(module, logger):
+    """
+    Return the PLY parser of MODULE, a jsonpath_rw JsonPathParser, loading its LALR tables from get_tables_file
+    when they were written by an earlier run, and writing them there otherwise
+    """
+    import ply.yacc
+    tables_file = get_tables_file()
+    if tables_file is not None:
+        try:
+            if os.path.exists(tables_file):
+                # PLY checks the grammar signature stored with the tables and rebuilds them if it changed
+                return ply.yacc.yacc(module=module, debug=False, start='jsonpath', errorlog=logger,
+                                     picklefile=tables_file)
+            # written under a temporary name, so concurrent workers never load a partial file
+            tmp_file = '{0}.{1}.tmp'.format(tables_file, os.getpid())
+            parser = ply.yacc.yacc(module=module, debug=False, start='jsonpath', errorlog=logger,
+                                   picklefile=tmp_file)
+            if os.path.exists(tmp_file):
+                os.replace(tmp_file, tables_file)
+            return parser
+        except Exception as e:
+            logger.warning('could not use the cached jsonpath parser tables %s: %s', tables_file, e)
+            try:
+                os.remove(tables_file)
+            except OSError:
+                pass
+    return ply.yacc.yacc(module=module, debug=False, write_tables=0, start='jsonpath', errorlog=logger)
+
+
+class JsonPathParser:
+    """
+    jsonpath_rw.parse rebuilds the PLY lexer and LALR tables on every call. This builds them once per process and
+    reuses them: the lexer is cloned per path and the table-driven parser is reentrant between calls. The LALR
+    tables are also cached on disk (see get_tables_file), so later processes load them instead of generating them.
+    """
+    def __init__(self):
+        import ply.lex
+        from jsonpath_rw.lexer import JsonPathLexer, JsonPathLexerError
+        from jsonpath_rw.parser import JsonPathParser as _JsonPathParser, IteratorToTokenStream
+        logger = logging.getLogger('jsonpath_rw')
+        self.lexer = ply.lex.lex(module=JsonPathLexer(), errorlog=logger)
+        self.parser = build_yacc_parser(_JsonPathParser(), logger)
+        self.token_stream = IteratorToTokenStream
+        self.lexer_error = JsonPathLexerError
+
+    def tokenize(self, string):
+        # same as JsonPathLexer.tokenize, on a copy of the prebuilt lexer
+        lexer = self.lexer.clone()
+        lexer.latest_newline = 0
+        lexer.string_value = None
+        lexer.input(string)
+        while True:
+            t = lexer.token()
+            if t is None:
+                break
+            t.col = t.lexpos - lexer.latest_newline
+            yield t
+        if lexer.string_value is not None:
+            raise self.lexer_error('Unexpected EOF in string literal or identifier')
+
+    def parse(self, string):
+        return self.parser.parse(lexer=self.token_stream(self.tokenize(string)))
+
+
+def parse(path):
+    """Parse the jsonpath PATH, like jsonpath_rw.parse"""
+    global _parser
+    if _parser is None:
+        _parser = JsonPathParser()
+    return _parser.parse(path)
+
+
+def get_parsed_path(path):
+    jp = _parsed_paths.get(path)
+    if jp is None:
+        _parse_stats['misses'] += 1
+        jp = parse(path)
+        _parsed_paths[path] = jp
+    else:
+        _parse_stats['hits'] += 1
+    return jp
+
+
+def parse_cache_info():
+    """Return hit/miss counters and the number of cached paths"""
+    return dict(_parse_stats, size=len(_parsed_paths))
+
+
+def clear_path_caches():
+    _parsed_paths.clear()
+    _compiled_paths.clear()
+    _parse_stats['hits'] = 0
+    _parse_stats['misses'] = 0
 
 
 def additional_global_fields(config, raw_json):
     if config.additional_global_fields:
         for field in config.additional_global_fields:
-            jp = parse(field['path'])
+            jp = get_parsed_path(field['path'])
             matches = jp.find(raw_json)
             if matches:
                 for match in matches:
@@ -37,16 +165,38 @@ def get_path(match):
 
 
 def recurse(child, fields_reverse):
-    if isinstance(child, Fields):
+    jsonpath = get_jsonpath()
+    if isinstance(child, jsonpath.Fields):
         fields_reverse.append(child.fields[0])
     else:
-        if not isinstance(child, Child):
+        if not isinstance(child, jsonpath.Child):
             raise Exception('unexpected input')
-        if not isinstance(child.left, Root):
+        if not isinstance(child.left, jsonpath.Root):
             recurse(child.left, fields_reverse)
         recurse(child.right, fields_reverse)
 
 
+def field_chain(path):
+    """
+    Return the field names PATH walks through, outermost first, when it is a plain chain of single
+    fields such as $.badge.issuer.name. Return None for paths using wildcards, indexes or other operators.
+    """
+    fields = []
+    jsonpath = get_jsonpath()
+
+    def walk(child):
+        if isinstance(child, jsonpath.Fields):
+            if len(child.fields) != 1 or child.fields[0] == '*':
+                return False
+            fields.append(child.fields[0])
+            return True
+        if not isinstance(child, jsonpath.Child):
+            return False
+        return (isinstance(child.left, jsonpath.Root) or walk(child.left)) and walk(child.right)
+
+    return fields if walk(get_parsed_path(path)) else None
+
+
 def update_json(json, path, value):
     '''Update JSON dictionary PATH with VALUE. Return updated JSON'''
     try:
@@ -63,24 +213,58 @@ def update_json(json, path, value):
         return value
 
 
-def set_field(raw_json, path, value):
-    jp = parse(path)
-    matches = jp.find(raw_json)
-    if matches:
-        for match in matches:
-            jsonpath_expr = get_path(match)
-            raw_json = update_json(raw_json, jsonpath_expr, value)
-    else:
-        fields = []
-        recurse(jp, fields)
-        temp_json = raw_json
-        for idx, f in enumerate(fields):
-            if f in temp_json:
-                temp_json = temp_json[f]
-            elif idx == len(fields) - 1:
-                temp_json[f] = value
+class CompiledPath:
+    """
+    A jsonpath resolved once. Plain field chains are applied with a direct setter that skips find and
+    update_json; other paths go through the generic jsonpath_rw matching.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.jp = get_parsed_path(path)
+        self.fields = field_chain(path)
+
+    def set(self, raw_json, value):
+        if self.fields:
+            node = raw_json
+            for f in self.fields[:-1]:
+                if not isinstance(node, dict) or f not in node:
+                    break
+                node = node[f]
             else:
-                msg = 'path is not valid! : ' + '.'.join(fields)
-                print(msg)
-                raise (Exception(msg))
-    return raw_json
+                if isinstance(node, dict):
+                    node[self.fields[-1]] = value
+                    return raw_json
+        return self._set_matches(raw_json, value)
+
+    def _set_matches(self, raw_json, value):
+        matches = self.jp.find(raw_json)
+        if matches:
+            for match in matches:
+                jsonpath_expr = get_path(match)
+                raw_json = update_json(raw_json, jsonpath_expr, value)
+        else:
+            fields = []
+            recurse(self.jp, fields)
+            temp_json = raw_json
+            for idx, f in enumerate(fields):
+                if f in temp_json:
+                    temp_json = temp_json[f]
+                elif idx == len(fields) - 1:
+                    temp_json[f] = value
+                else:
+                    msg = 'path is not valid! : ' + '.'.join(fields)
+                    print(msg)
+                    raise (Exception(msg))
+        return raw_json
+
+
+def compile_path(path):
+    compiled = _compiled_paths.get(path)
+    if compiled is None:
+        compiled = CompiledPath(path)
+        _compiled_paths[path] = compiled
+    return compiled
+
+
+def set_field(raw_json, path, value):
+    return compile_path(path).set(raw_json, value)
@@ -0,0 +1,315 @@
+'''
+Output sinks for unsigned certificates.
+
+The default sink writes one <uid>.json file per certificate into the unsigned certificates directory. For very
+large batches, especially on network filesystems, the other sinks stream every certificate of the batch into a
+single JSON Lines file or tar/zip archive instead. With writer threads, the directory sink hands certificates to a
+background pool so that generation and disk writes overlap. Every sink writes certificates through the
+json_serializer it is given.
+'''
+import io
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+
+from cert_tools import batch_stats
+from cert_tools import json_serializer
+
+SINK_TYPES = ['directory', 'jsonl', 'tar', 'zip']
+BUFFER_SIZE = 1 << 20
+# certificates a writer thread takes from the queue at a time, written before a single directory fsync
+WRITE_BATCH_SIZE = 64
+
+
+class SinkError(Exception):
+    """A certificate handed to a sink earlier could not be written"""
+
+
+def is_directory_sink(sink_type):
+    return not sink_type or sink_type == 'directory'
+
+
+def scan_existing_uids(output_dir):
+    """Return the uids of the certificates already in OUTPUT_DIR, in a single directory scan"""
+    uids = set()
+    for entry in os.scandir(output_dir):
+        if entry.name.endswith('.json'):
+            uids.add(entry.name[:-len('.json')])
+    return uids
+
+
+class DirectorySink:
+    def __init__(self, output_dir, no_clobber=False, existing_uids=None, serializer=None):
+        """
+        :param existing_uids: with NO_CLOBBER, the result of scan_existing_uids if already known
+        :param serializer: a json_serializer.JsonSerializer; defaults to json_serializer.DEFAULT
+        """
+        self.location = output_dir
+        self.no_clobber = no_clobber
+        self.serializer = serializer or json_serializer.DEFAULT
+        if no_clobber and existing_uids is None:
+            existing_uids = scan_existing_uids(output_dir)
+        self.existing_uids = existing_uids
+
+    def write(self, uid, cert):
+        if self.no_clobber:
+            if uid in self.existing_uids:
+                return
+            self.existing_uids.add(uid)
+        self.write_file(uid, cert)
+
+    def write_file(self, uid, cert):
+        cert_file = os.path.join(self.location, uid + '.json')
+        data = self.serializer.dumpb(cert)
+        with open(cert_file, 'wb') as unsigned_cert:
+            unsigned_cert.write(data)
+
+    def flush(self):
+        pass
+
+    def position(self):
+        """Length of a single-file output, recorded by a checkpoint journal at each commit; None for a directory"""
+        return None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteBehindSink(DirectorySink):
+    """
+    Directory sink whose files are written by a pool of threads fed through a bounded queue, so the generation
+    loop doesn't wait on the disk. Each certificate is written to a temporary file and renamed into place, so a
+    crash never leaves a partial <uid>.json. flush returns once every queued certificate is in place (and, with
+    fsync, synced along with the directory), which is when a checkpoint journal may record them.
+    """
+    def __init__(self, output_dir, no_clobber=False, existing_uids=None, writer_threads=1, fsync=False,
+                 batch_size=WRITE_BATCH_SIZE, serializer=None):
+        super(WriteBehindSink, self).__init__(output_dir, no_clobber, existing_uids, serializer)
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=2 * writer_threads * batch_size)
+        self.error = None
+        self.threads = [threading.Thread(target=self.drain, daemon=True) for _ in range(writer_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def write_file(self, uid, cert):
+        self.check()
+        self.queue.put((uid, cert))
+
+    def drain(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                # one None per thread ends the pool
+                stop = True
+            try:
+                if self.error is None:
+                    self.write_batch([item for item in batch if item is not None])
+            except BaseException as e:
+                self.error = e
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write_batch(self, batch):
+        suffix = '.{0}.tmp'.format(threading.get_ident())
+        for uid, cert in batch:
+            cert_file = os.path.join(self.location, uid + '.json')
+            tmp_file = os.path.join(self.location, '.' + uid + '.json' + suffix)
+            with open(tmp_file, 'wb') as unsigned_cert:
+                unsigned_cert.write(self.serializer.dumpb(cert))
+                if self.fsync:
+                    unsigned_cert.flush()
+                    os.fsync(unsigned_cert.fileno())
+            os.replace(tmp_file, cert_file)
+        if self.fsync and batch:
+            # one directory sync makes the whole batch of renames durable
+            fsync_directory(self.location)
+
+    def check(self):
+        if self.error is not None:
+            raise SinkError('writing certificates to {0} failed: {1}'.format(self.location, self.error))
+
+    def flush(self):
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        if self.threads:
+            for _ in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+        self.check()
+
+
+class ArchiveSink(DirectorySink):
+    """Base class for the sinks writing the whole batch into a single file"""
+    appendable = False
+
+    def __init__(self, archive_file, no_clobber=False, append=False, serializer=None, offset=None):
+        if append and not self.appendable:
+            raise Exception('cannot append to an existing {0} archive'.format(self.__class__.__name__))
+        if no_clobber and not append and os.path.exists(archive_file):
+            raise Exception('output archive already exists: ' + archive_file)
+        self.location = archive_file
+        self.no_clobber = no_clobber
+        self.serializer = serializer or json_serializer.DEFAULT
+
+    def flush(self):
+        self.handle.flush()
+
+
+class JsonLinesSink(ArchiveSink):
+    appendable = True
+
+    def __init__(self, archive_file, no_clobber=False, append=False, serializer=None, offset=None):
+        super(JsonLinesSink, self).__init__(archive_file, no_clobber, append, serializer, offset)
+        if not append:
+            self.handle = open(archive_file, 'wb', buffering=BUFFER_SIZE)
+            return
+        if offset is None:
+            raise Exception('cannot append to {0} without the length recorded by its checkpoint'.format(archive_file))
+        self.handle = open(archive_file, 'r+b', buffering=BUFFER_SIZE)
+        if self.handle.seek(0, os.SEEK_END) < offset:
+            raise Exception('{0} is shorter than recorded by its checkpoint'.format(archive_file))
+        # drop the lines written after the last checkpoint commit, which are written again
+        self.handle.truncate(offset)
+        self.handle.seek(offset)
+
+    def position(self):
+        return self.handle.tell()
+
+    def write(self, uid, cert):
+        self.handle.write(self.serializer.dumpb({'uid': uid, 'certificate': cert}) + b'\n')
+
+    def close(self):
+        self.handle.close()
+
+
+class TarSink(ArchiveSink):
+    def __init__(self, archive_file, no_clobber=False, append=False, serializer=None, offset=None):
+        super(TarSink, self).__init__(archive_file, no_clobber, append, serializer, offset)
+        mode = 'w|gz' if archive_file.endswith('gz') else 'w|'
+        self.handle = open(archive_file, 'wb', buffering=BUFFER_SIZE)
+        self.archive = tarfile.open(fileobj=self.handle, mode=mode)
+        self.mtime = time.time()
+
+    def write(self, uid, cert):
+        data = self.serializer.dumpb(cert)
+        info = tarfile.TarInfo(uid + '.json')
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+        self.handle.close()
+
+
+class ZipSink(ArchiveSink):
+    def __init__(self, archive_file, no_clobber=False, append=False, serializer=None, offset=None):
+        super(ZipSink, self).__init__(archive_file, no_clobber, append, serializer, offset)
+        self.handle = open(archive_file, 'wb', buffering=BUFFER_SIZE)
+        self.archive = zipfile.ZipFile(self.handle, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, uid, cert):
+        self.archive.writestr(uid + '.json', self.serializer.dumpb(cert))
+
+    def close(self):
+        self.archive.close()
+        self.handle.close()
+
+
+ARCHIVE_SINKS = {
+    'jsonl': (JsonLinesSink, '.jsonl'),
+    'tar': (TarSink, '.tar'),
+    'zip': (ZipSink, '.zip'),
+}
+
+
+def get_sink(sink_type, output_dir, archive_file=None, no_clobber=False, append=False, existing_uids=None,
+             writer_threads=0, fsync=False, serializer=None, offset=None):
+    """
+    Return the sink selected by the output_sink configuration
+
+    :param sink_type: one of SINK_TYPES; None selects the directory sink
+    :param output_dir: the unsigned certificates directory
+    :param archive_file: file name of the jsonl/tar/zip output, relative to OUTPUT_DIR. Defaults to
+        unsigned_certificates.<jsonl|tar|zip>
+    :param no_clobber: skip existing certificate files, or refuse to overwrite an existing archive
+    :param append: add to an existing output, when resuming a batch. Only the directory and jsonl sinks support it
+    :param existing_uids: for the directory sink, the uids already in OUTPUT_DIR if they have been scanned
+    :param writer_threads: for the directory sink, number of background threads writing the files; 0 writes them
+        in the calling thread
+    :param fsync: for the directory sink, sync files and the directory to disk before they count as written;
+        implies at least one writer thread
+    :param serializer: the json_serializer.JsonSerializer writing the certificates; defaults to the standard layout
+    :param offset: with APPEND, for the jsonl sink, the length of the file at the last checkpoint commit; anything
+        after it is cut off
+    """
+    if is_directory_sink(sink_type):
+        if writer_threads > 0 or fsync:
+            return WriteBehindSink(output_dir, no_clobber, existing_uids, max(writer_threads, 1), fsync,
+                                   serializer=serializer)
+        return DirectorySink(output_dir, no_clobber, existing_uids, serializer)
+    if sink_type not in ARCHIVE_SINKS:
+        raise Exception('unknown output sink {0}; expected one of {1}'.format(sink_type, ', '.join(SINK_TYPES)))
+    sink_class, extension = ARCHIVE_SINKS[sink_type]
+    archive_file = os.path.join(output_dir, archive_file or 'unsigned_certificates' + extension)
+    return sink_class(archive_file, no_clobber, append, serializer, offset)
+
+
+def write_unsigned_certificates(certs, sink, checkpoint=None, stats=None):
+    """
+    Write (uid, cert) pairs to SINK as they arrive; CERTS may be a lazy generator. When a CHECKPOINT journal is
+    given, each row is recorded in it before its certificate is handed to the sink, and the rows are committed
+    after the sink has been flushed.
+    Write and commit times are charged to STATS, a batch_stats.BatchStats, if given.
+    """
+    if stats is None:
+        stats = batch_stats.NULL_STATS
+    for uid, cert in certs:
+        stats.mark()
+        if checkpoint is not None:
+            # a crash before the next commit then rewrites the row under the same uid
+            checkpoint.record(uid)
+        if cert is not None:
+            # None marks a row skipped because its certificate already exists
+            sink.write(uid, cert)
+        stats.lap('write')
+        if checkpoint is not None and checkpoint.pending >= checkpoint.commit_every:
+            sink.flush()
+            checkpoint.commit(sink.position())
+            stats.lap('commit')
+    stats.mark()
+    # waits for write-behind sinks to finish
+    sink.flush()
+    if checkpoint is not None:
+        checkpoint.commit(sink.position())
+    stats.lap('commit')
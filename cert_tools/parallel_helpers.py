@@ -0,0 +1,56 @@
+'''
+Process pool helpers shared by the batch tools.
+'''
+import collections
+import itertools
+import multiprocessing
+
+
+def chunked(iterable, size):
+    """Lazily split ITERABLE into lists of at most SIZE items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _get_items(result, merge):
+    items = result.get()
+    if merge is not None:
+        items, extra = items
+        merge(extra)
+    return items
+
+
+def imap_chunks(func, iterable, workers, chunk_size, initializer=None, initargs=(), merge=None):
+    """
+    Apply FUNC to CHUNK_SIZE chunks of ITERABLE in a pool of WORKERS processes and yield every item of
+    the returned lists in input order.
+
+    Unlike Pool.imap, which drains its input eagerly, at most two chunks per worker are in flight at any
+    time, so a lazy roster is never read far ahead of the output.
+
+    :param func: module-level function taking a list and returning a list
+    :param initializer: called once in each worker process with INITARGS, e.g. to load a template
+    :param merge: if given, FUNC returns (list, extra) and MERGE(extra) is called in this process for every
+        chunk, e.g. to collect worker stats
+    """
+    pool = multiprocessing.Pool(workers, initializer, initargs)
+    try:
+        pending = collections.deque()
+        for chunk in chunked(iterable, chunk_size):
+            pending.append(pool.apply_async(func, (chunk,)))
+            if len(pending) >= workers * 2:
+                for item in _get_items(pending.popleft(), merge):
+                    yield item
+        while pending:
+            for item in _get_items(pending.popleft(), merge):
+                yield item
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -0,0 +1,145 @@
+'''
+Compact roster records for the instantiate tools.
+
+Roster columns are resolved to indexes once from the CSV header. Each row then stays the list csv.reader returns:
+recipients keep their fixed fields in __slots__ and read their additional fields through a view on the row, so
+no dict is built per row.
+'''
+import csv
+import itertools
+
+
+class RosterColumns:
+    def __init__(self, header, required):
+        """
+        :param header: the roster's header row
+        :param required: names of the columns every recipient has, e.g. name, pubkey and identity
+        """
+        missing = [column for column in required if column not in header]
+        if missing:
+            raise Exception('roster is missing the column(s) {0}'.format(', '.join(missing)))
+        indexes = dict((column, i) for i, column in enumerate(header))
+        self.width = len(header)
+        self.required = [indexes[column] for column in required]
+        # the other columns, in roster order, by name
+        self.additional = dict((column, i) for i, column in enumerate(header) if column not in required)
+
+
+class AdditionalFields:
+    """Read-only mapping of a row's additional columns, by column name"""
+    __slots__ = ('columns', 'row')
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+    def __getitem__(self, key):
+        return self.row[self.columns.additional[key]]
+
+    def __contains__(self, key):
+        return key in self.columns.additional
+
+    def __iter__(self):
+        return iter(self.columns.additional)
+
+    def __len__(self):
+        return len(self.columns.additional)
+
+    def get(self, key, default=None):
+        index = self.columns.additional.get(key)
+        return default if index is None else self.row[index]
+
+    def keys(self):
+        return self.columns.additional.keys()
+
+    def items(self):
+        return [(key, self.row[i]) for key, i in self.columns.additional.items()]
+
+
+def iter_roster_rows(roster_file, required, start_row=0):
+    """
+    Yield (columns, row) for every row of ROSTER_FILE; short rows are padded with None like csv.DictReader.
+    The first START_ROW rows, e.g. those finished before a batch was resumed, are only tokenized by csv.reader and
+    skipped without leaving C code.
+    """
+    with open(roster_file, 'r') as theFile:
+        reader = csv.reader(theFile)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = RosterColumns(header, required)
+        width = columns.width
+        # blank lines are skipped, by csv.DictReader too, and don't count as rows
+        rows = filter(None, reader)
+        if start_row:
+            rows = itertools.islice(rows, start_row, None)
+        for row in rows:
+            if len(row) < width:
+                row.extend([None] * (width - len(row)))
+            yield columns, row
+
+
+def preflight_roster(roster_file, required, additional_fields=None, pubkey_pattern=None, uid_for_identity=None):
+    """
+    Scan ROSTER_FILE once, without building any certificate, and return every problem found as (line, message)
+    pairs; line numbers are those of the CSV file, the header being line 1.
+
+    :param required: the columns every recipient needs
+    :param additional_fields: the additional_per_recipient_fields configuration; their csv_column must be in the
+        header, and without it the roster must not have any other column
+    :param pubkey_pattern: compiled regex every pubkey must match
+    :param uid_for_identity: with identity based file names, the function turning an identity into a uid;
+        identities with the same uid are reported
+    """
+    problems = []
+    with open(roster_file, 'r') as theFile:
+        reader = csv.reader(theFile)
+        header = next(reader, None)
+        if header is None:
+            return [(1, 'roster is empty')]
+
+        missing = [column for column in required if column not in header]
+        expected = [field['csv_column'] for field in additional_fields or []]
+        missing.extend(column for column in expected if column not in header)
+        if missing:
+            problems.append((1, 'missing column(s) {0}'.format(', '.join(missing))))
+        if not additional_fields:
+            unexpected = [column for column in header if column not in required]
+            if unexpected:
+                problems.append((1, 'column(s) {0} are not expected by the additional_per_recipient_fields '
+                                    'configuration'.format(', '.join(unexpected))))
+        duplicates = [column for column in set(header) if header.count(column) > 1]
+        if duplicates:
+            problems.append((1, 'duplicate column(s) {0}'.format(', '.join(sorted(duplicates)))))
+
+        indexes = dict((column, i) for i, column in enumerate(header))
+        pubkey_index = indexes.get('pubkey')
+        identity_index = indexes.get('identity')
+        first_line_by_uid = {}
+        for row in reader:
+            line = reader.line_num
+            if not row:
+                continue
+            if len(row) != len(header):
+                problems.append((line, 'expected {0} values, found {1}'.format(len(header), len(row))))
+                continue
+            if pubkey_pattern is not None and pubkey_index is not None and not pubkey_pattern.match(row[pubkey_index]):
+                problems.append((line, 'invalid pubkey {0!r}'.format(row[pubkey_index])))
+            if uid_for_identity is not None and identity_index is not None:
+                uid = uid_for_identity(row[identity_index])
+                if not uid:
+                    problems.append((line, 'identity {0!r} gives an empty file name'.format(row[identity_index])))
+                elif uid in first_line_by_uid:
+                    problems.append((line, 'identity {0!r} gives the same file name as line {1}'.format(
+                        row[identity_index], first_line_by_uid[uid])))
+                else:
+                    first_line_by_uid[uid] = line
+    return problems
+
+
+def check_roster(roster_file, *args, **kwargs):
+    """Run preflight_roster and raise an exception listing every problem, if any"""
+    problems = preflight_roster(roster_file, *args, **kwargs)
+    if problems:
+        raise Exception('{0} problem(s) in roster {1}:\n{2}'.format(
+            len(problems), roster_file, '\n'.join('  line {0}: {1}'.format(line, message) for line, message in problems)))
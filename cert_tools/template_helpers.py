@@ -0,0 +1,60 @@
+'''
+Compiled certificate templates.
+
+Templates carry large immutable subtrees (base64 badge images, issuer logos, signature lines) while a recipient
+only changes a handful of nodes. A CompiledTemplate records those nodes once, then builds each certificate by
+copying only the path down to them and sharing everything else with the template.
+'''
+import copy
+
+from cert_tools import jsonpath_helpers
+
+
+def build_spine(field_chains):
+    """
+    Merge FIELD_CHAINS into a nested dict of the nodes that must be copied per certificate. A value of None
+    marks a node that is replaced or mutated by the recipient and is therefore deep-copied.
+    """
+    spine = {}
+    for chain in field_chains:
+        node = spine
+        for key in chain[:-1]:
+            if key in node and node[key] is None:
+                # an ancestor is already deep-copied
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[chain[-1]] = None
+    return spine
+
+
+def copy_spine(node, spine):
+    if spine is None or not isinstance(node, dict):
+        return copy.deepcopy(node)
+    copied = dict(node)
+    for key, child_spine in spine.items():
+        if key in copied:
+            copied[key] = copy_spine(copied[key], child_spine)
+    return copied
+
+
+class CompiledTemplate:
+    def __init__(self, template, paths):
+        """
+        :param template: the certificate template
+        :param paths: jsonpaths of every node a recipient changes. If any of them is not a plain chain of fields,
+            the changed nodes can't be known up front and instantiate falls back to a full deepcopy.
+        """
+        self.template = template
+        field_chains = [jsonpath_helpers.field_chain(path) for path in paths]
+        if any(not chain for chain in field_chains):
+            self.spine = None
+        else:
+            self.spine = build_spine(field_chains)
+
+    def instantiate(self):
+        """
+        Return a new certificate. Only the per-recipient paths are private to it; all other subtrees are
+        shared with the template and must not be modified.
+        """
+        return copy_spine(self.template, self.spine)
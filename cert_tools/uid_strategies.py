@@ -0,0 +1,118 @@
+'''
+Certificate uid strategies, selected with filename_format.
+
+- uuid: a random uuid4 per certificate (the default)
+- certname_identity: the recipient identity (after an optional prefix) with everything but letters and digits
+  removed
+- uuid5_identity: a name-based uuid5 of the identity, in a namespace derived from the template
+- sequential: the roster row number
+
+All but uuid give the same uids when a roster is instantiated again. Identities that normalize to the same uid
+would overwrite each other's certificate, so an index of the uids given out detects collisions, which are resolved
+deterministically with a short hash of the identity (and a counter for identical identities).
+'''
+import hashlib
+import string
+import uuid
+
+STRATEGIES = ['uuid', 'certname_identity', 'uuid5_identity', 'sequential']
+DETERMINISTIC_STRATEGIES = ['certname_identity', 'uuid5_identity', 'sequential']
+
+_ALNUM_ASCII = (string.ascii_letters + string.digits).encode('ascii')
+# bytes.translate deletes these in one C-level pass
+_NON_ALNUM_ASCII = bytes(b for b in range(128) if b not in _ALNUM_ASCII)
+
+
+class _AlnumTable(dict):
+    """str.translate table dropping non alphanumeric characters, filled in as characters are seen"""
+    def __missing__(self, code):
+        value = code if chr(code).isalnum() else None
+        self[code] = value
+        return value
+
+
+_ALNUM_TABLE = _AlnumTable()
+
+
+def normalize(text):
+    """Remove everything but letters and digits, like "".join(c for c in text if c.isalnum())"""
+    if text.isascii():
+        return text.encode('ascii').translate(None, _NON_ALNUM_ASCII).decode('ascii')
+    return text.translate(_ALNUM_TABLE)
+
+
+class UidAllocator:
+    def __init__(self, strategy=None, prefix='', namespace=None, start=0):
+        """
+        :param strategy: one of STRATEGIES; None selects uuid
+        :param prefix: with certname_identity, text put before every identity, e.g. the badge name
+        :param namespace: with uuid5_identity, a name identifying the batch, e.g. the badge id
+        :param start: with sequential, the number of the first row
+        """
+        strategy = strategy or 'uuid'
+        if strategy not in STRATEGIES:
+            raise Exception('unknown filename_format {0}; expected one of {1}'.format(strategy, ', '.join(STRATEGIES)))
+        self.strategy = strategy
+        self.prefix = prefix
+        self.namespace = uuid.uuid5(uuid.NAMESPACE_URL, namespace or '')
+        self.next_row = start
+        self.uids = set()
+        self.collisions = 0
+
+    @property
+    def deterministic(self):
+        return self.strategy in DETERMINISTIC_STRATEGIES
+
+    def reserve(self, uids):
+        """Mark UIDS as taken, e.g. the uids given out before a resumed batch was interrupted"""
+        self.uids.update(uids)
+
+    def reuse(self, uid):
+        """Return UID, given to the next roster row by an earlier run, e.g. one interrupted before writing it"""
+        self.next_row += 1
+        self.uids.add(uid)
+        return uid
+
+    @property
+    def identity_based(self):
+        return self.strategy in ('certname_identity', 'uuid5_identity')
+
+    def identity_uid(self, identity):
+        """The uid IDENTITY maps to before collisions are resolved, for the identity based strategies"""
+        if self.strategy == 'certname_identity':
+            return normalize(self.prefix + identity)
+        return str(uuid.uuid5(self.namespace, identity))
+
+    def allocate(self, identity):
+        """Return the uid of the next roster row, whose recipient identity is IDENTITY"""
+        if self.strategy == 'uuid':
+            return str(uuid.uuid4())
+        if self.identity_based:
+            uid = self.identity_uid(identity)
+        else:
+            uid = str(self.next_row)
+            self.next_row += 1
+
+        if uid in self.uids:
+            self.collisions += 1
+            base = uid + '-' + hashlib.sha256(identity.encode('utf-8')).hexdigest()[:8]
+            uid = base
+            count = 1
+            while uid in self.uids:
+                count += 1
+                uid = '{0}-{1}'.format(base, count)
+        self.uids.add(uid)
+        return uid
+
+
+def assign_uids(recipients, allocator, known_uids=None, start_row=0):
+    """
+    Set the uid of each recipient as it goes by, e.g. in the parent process before rows go to workers. Rows found in
+    KNOWN_UIDS, {row: uid} with the first recipient at row START_ROW, keep the uid an earlier run gave them
+    """
+    for row, recipient in enumerate(recipients, start_row):
+        if known_uids and row in known_uids:
+            recipient.uid = allocator.reuse(known_uids[row])
+        else:
+            recipient.uid = allocator.allocate(recipient.identity)
+        yield recipient
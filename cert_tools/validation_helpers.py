@@ -0,0 +1,117 @@
+'''
+Schema validation for unsigned certificates with the schema loaded and compiled once per process.
+
+cert_schema.schema_validator re-reads and re-checks the schema file on every call, which dominates
+batch runtime. These functions are drop-in replacements that keep the same failure behavior
+(log and raise BlockcertValidationError).
+
+jsonschema and cert_schema are imported on first use, so the scripts importing this module start fast.
+'''
+import json
+import logging
+
+from cert_tools import jsonpath_helpers
+
+_validators = {}
+
+
+def get_validator(schema_file, ignore_proof=False):
+    """Return the compiled validator for SCHEMA_FILE, loading it on first use
+
+    Arguments:
+    - `schema_file`: One of the cert_schema.schema_validator SCHEMA_* paths
+    - `ignore_proof`: Drop 'proof' from the required properties, for unsigned certificates
+    """
+    key = (schema_file, ignore_proof)
+    validator = _validators.get(key)
+    if validator is None:
+        import jsonschema
+        with open(schema_file) as schema_f:
+            schema_json = json.load(schema_f)
+        if ignore_proof:
+            schema_json['required'].remove('proof')
+        cls = jsonschema.validators.validator_for(schema_json)
+        cls.check_schema(schema_json)
+        validator = cls(schema_json)
+        _validators[key] = validator
+    return validator
+
+
+def get_fragment_validator(schema_file, keys, ignore_proof=False):
+    """Return a validator checking only the top-level properties KEYS, sharing the schema's definitions"""
+    key = (schema_file, ignore_proof, tuple(sorted(keys)))
+    validator = _validators.get(key)
+    if validator is None:
+        full_schema = get_validator(schema_file, ignore_proof).schema
+        schema_json = dict(full_schema)
+        schema_json['properties'] = dict((k, v) for k, v in full_schema.get('properties', {}).items() if k in keys)
+        schema_json['required'] = [k for k in full_schema.get('required', []) if k in keys]
+        import jsonschema
+        validator = jsonschema.validators.validator_for(schema_json)(schema_json)
+        _validators[key] = validator
+    return validator
+
+
+def validate_json(certificate_json, validator):
+    from jsonschema.exceptions import best_match
+    from cert_schema.errors import BlockcertValidationError
+    error = best_match(validator.iter_errors(certificate_json))
+    if error is not None:
+        logging.error(error, exc_info=True)
+        raise BlockcertValidationError(error)
+    return True
+
+
+def validate_v2(certificate_json):
+    from cert_schema import schema_validator
+    return validate_json(certificate_json, get_validator(schema_validator.SCHEMA_FILE_V2_0))
+
+
+def validate_v3(certificate_json, ignore_proof=False):
+    from cert_schema import schema_validator
+    return validate_json(certificate_json, get_validator(schema_validator.SCHEMA_FILE_V3, ignore_proof))
+
+
+def validate_unsigned_v1_2(certificate_json):
+    import jsonschema
+    from cert_schema import schema_validator
+    # first a conditional check not done in the json schema
+    if certificate_json['recipient']['hashed'] and not certificate_json['recipient']['salt']:
+        logging.error('certificate is hashed but has no salt')
+        raise jsonschema.exceptions.ValidationError('certificate is hashed but has no salt')
+
+    return validate_json(certificate_json, get_validator(schema_validator.SCHEMA_UNSIGNED_FILE_V1_2))
+
+
+class FragmentValidator:
+    """
+    Validates the first certificate of a batch against the whole schema, which checks the instantiated template
+    shape, then only the top-level properties that change per recipient. Everything else is shared with the
+    template and cannot differ between certificates.
+    """
+    def __init__(self, schema_file, per_recipient_paths, ignore_proof=False, full_validation_every=0):
+        """
+        :param per_recipient_paths: jsonpaths of the nodes each recipient changes
+        :param full_validation_every: also validate every Nth certificate in full; 0 to only validate the first
+        """
+        self.full_validator = get_validator(schema_file, ignore_proof)
+        self.full_validation_every = full_validation_every
+        self.count = 0
+
+        field_chains = [jsonpath_helpers.field_chain(path) for path in per_recipient_paths]
+        if any(not chain for chain in field_chains):
+            # the changed nodes can't be known up front
+            self.keys = None
+            self.fragment_validator = None
+        else:
+            self.keys = set(chain[0] for chain in field_chains)
+            self.fragment_validator = get_fragment_validator(schema_file, self.keys, ignore_proof)
+
+    def __call__(self, certificate_json):
+        self.count += 1
+        if self.fragment_validator is None or self.count == 1 or \
+                (self.full_validation_every and self.count % self.full_validation_every == 0):
+            return validate_json(certificate_json, self.full_validator)
+
+        fragment = dict((k, certificate_json[k]) for k in self.keys if k in certificate_json)
+        return validate_json(fragment, self.fragment_validator)
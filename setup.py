@@ -31,6 +31,7 @@ setup(
         'console_scripts': [
             'create-certificate-template_v2 = cert_tools.create_v2_certificate_template:main',
             'create-certificate-template = cert_tools.create_v3_certificate_template:main',
+            'create-certificate-templates = cert_tools.create_certificate_templates:main',
             'instantiate-certificate-batch_v2 = cert_tools.instantiate_v2_certificate_batch:main',
             'instantiate-certificate-batch = cert_tools.instantiate_v3_certificate_batch:main',
             'create-issuer = cert_tools.create_v2_issuer:main'
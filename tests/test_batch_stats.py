@@ -0,0 +1,28 @@
+import unittest
+
+from cert_tools import batch_stats
+
+
+class TestBatchStats(unittest.TestCase):
+    def test_merge_worker_stats(self):
+        stats = batch_stats.BatchStats()
+        for _ in range(3):
+            stats.start_row()
+            stats.lap('copy')
+            stats.end_row()
+
+        worker = batch_stats.BatchStats()
+        worker.start_row()
+        worker.lap('copy')
+        worker.lap('validation')
+        worker.end_row()
+        stats.merge(worker.to_dict())
+
+        self.assertEqual(stats.rows, 4)
+        self.assertEqual(sum(stats.histogram), 4)
+        self.assertEqual(set(stats.stages), {'copy', 'validation'})
+        self.assertIsNotNone(stats.percentile(0.99))
+
+
+if __name__ == '__main__':
+    unittest.main()
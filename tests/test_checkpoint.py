@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cert_tools import checkpoint
+
+
+class TestCheckpointJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.journal_file = os.path.join(self.tmp_dir, 'checkpoint.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resume_starts_after_committed_rows(self):
+        with checkpoint.CheckpointJournal(self.journal_file, 'roster.csv', '2021-01-01T00:00:00Z') as journal:
+            for uid in ('a', 'b', 'c'):
+                journal.record(uid)
+            journal.commit()
+        # a crash while appending leaves a truncated line
+        with open(self.journal_file, 'a') as f:
+            f.write('{"row": 3, "ui')
+
+        journal = checkpoint.CheckpointJournal(self.journal_file, 'roster.csv', '2022-02-02T00:00:00Z', resume=True)
+        journal.close()
+        self.assertEqual(journal.start_row, 3)
+        self.assertEqual(journal.uids, {0: 'a', 1: 'b', 2: 'c'})
+        self.assertEqual(journal.issued_on, '2021-01-01T00:00:00Z')
+
+    def test_resume_twice_after_truncated_lines(self):
+        with checkpoint.CheckpointJournal(self.journal_file, 'roster.csv', '2021-01-01T00:00:00Z') as journal:
+            for uid in ('a', 'b', 'c'):
+                journal.record(uid)
+            journal.commit()
+        with open(self.journal_file, 'a') as f:
+            f.write('{"row": 3, "ui')
+
+        with checkpoint.CheckpointJournal(self.journal_file, 'roster.csv', '2021-01-01T00:00:00Z', resume=True) as journal:
+            journal.record('d')
+            journal.commit()
+        with open(self.journal_file, 'a') as f:
+            f.write('{"row"')
+
+        journal = checkpoint.CheckpointJournal(self.journal_file, 'roster.csv', '2021-01-01T00:00:00Z', resume=True)
+        journal.close()
+        self.assertEqual(journal.start_row, 4)
+        self.assertEqual(journal.uids, {0: 'a', 1: 'b', 2: 'c', 3: 'd'})
+        with open(self.journal_file) as f:
+            self.assertTrue(f.read().endswith('{"row": 3, "uid": "d"}\n{"written": 4}\n'))
+
+    def test_uncommitted_rows_keep_their_uids(self):
+        journal = checkpoint.CheckpointJournal(self.journal_file, 'roster.csv', '2021-01-01T00:00:00Z')
+        journal.record('a')
+        journal.commit(10)
+        journal.record('b')
+        journal.record('c')
+        # rows are journaled as soon as they are recorded, but only count as written once committed
+        self.assertEqual(checkpoint.read_journal(self.journal_file)[1:], ({0: 'a', 1: 'b', 2: 'c'}, 1))
+        journal.close()
+
+        journal = checkpoint.CheckpointJournal(self.journal_file, 'roster.csv', '2021-01-01T00:00:00Z', resume=True)
+        journal.close()
+        self.assertEqual(journal.start_row, 1)
+        self.assertEqual(journal.offset, 10)
+        self.assertEqual(journal.uids, {0: 'a', 1: 'b', 2: 'c'})
+
+    def test_resume_with_another_roster_fails(self):
+        checkpoint.CheckpointJournal(self.journal_file, 'roster.csv', '2021-01-01T00:00:00Z').close()
+        with self.assertRaises(Exception):
+            checkpoint.CheckpointJournal(self.journal_file, 'other.csv', '2021-01-01T00:00:00Z', resume=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
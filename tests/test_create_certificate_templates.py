@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cert_tools import create_certificate_templates
+from cert_tools import image_cache
+
+
+class TestCreateCertificateTemplates(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'images'))
+        os.makedirs(os.path.join(self.tmp_dir, 'certificate_templates'))
+        for name in ['logo.png', 'physics.png', 'history.png', 'signature.png']:
+            with open(os.path.join(self.tmp_dir, 'images', name), 'wb') as f:
+                f.write(os.urandom(100))
+        self.cache = image_cache.configure()
+
+    def tearDown(self):
+        image_cache.configure()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_v2_templates_share_images(self):
+        manifest = {
+            'version': 'v2',
+            'defaults': {
+                'data_dir': self.tmp_dir, 'template_dir': 'certificate_templates', 'issuer_name': 'University',
+                'issuer_email': 'contact@issuer.org', 'issuer_id': 'https://issuer.org/issuer.json',
+                'issuer_logo_file': 'images/logo.png', 'criteria_narrative': 'Pass the exam',
+                'issuer_signature_lines': {'fields': [{'job_title': 'Dean', 'name': 'Dean',
+                                                       'signature_image': 'images/signature.png'}]}
+            },
+            'templates': [
+                {'template_file_name': name + '.json', 'certificate_title': name.title(),
+                 'cert_image_file': 'images/{0}.png'.format(name), 'badge_id': badge_id}
+                for name, badge_id in [('physics', '82a4c9f2-3588-457b-80ea-da695571b8fc'),
+                                       ('history', '4b6c7e3e-6c0d-4e0e-9b8f-8c0ff2e0a1d2')]
+            ]
+        }
+        self.assertEqual(create_certificate_templates.write_certificate_templates(manifest), 2)
+        with open(os.path.join(self.tmp_dir, 'certificate_templates', 'history.json')) as f:
+            template = json.load(f)
+        self.assertEqual(template['badge']['name'], 'History')
+        self.assertEqual(template['badge']['issuer']['name'], 'University')
+        # the logo and signature are encoded once for both templates
+        self.assertEqual((self.cache.misses, self.cache.hits), (4, 2))
+
+    def test_rejects_unknown_and_missing_options(self):
+        defaults = {'data_dir': self.tmp_dir, 'template_dir': 'certificate_templates'}
+        for overrides in [{'template_file_name': 'a.json', 'issuer_id': 'x', 'issuer_nmae': 'typo'},
+                          {'template_file_name': 'a.json'}]:
+            with self.assertRaises(Exception):
+                create_certificate_templates.write_certificate_templates(
+                    {'defaults': defaults, 'templates': [overrides]})
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'certificate_templates')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
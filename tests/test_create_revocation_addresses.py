@@ -0,0 +1,109 @@
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from cert_tools import create_revocation_addresses
+from cert_tools import derivation_cache
+
+
+class FakeNode:
+    def __init__(self, path=''):
+        self.path = path
+
+    def subkey_for_path(self, path):
+        return FakeNode(path)
+
+    def subkey(self, i):
+        return FakeNode('{0}/{1}'.format(self.path, i))
+
+    def address(self, use_uncompressed=None):
+        return 'addr' + self.path
+
+
+class TestCreateRevocationAddresses(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.get_key_path_node = create_revocation_addresses.get_key_path_node
+        create_revocation_addresses.get_key_path_node = lambda xpub, key_path: FakeNode(key_path)
+
+    def tearDown(self):
+        create_revocation_addresses.get_key_path_node = self.get_key_path_node
+        shutil.rmtree(self.tmp_dir)
+
+    def get_config(self, **kwargs):
+        config = argparse.Namespace(extended_public_key='xpub', key_path='2016/1', number_of_addresses=3,
+                                    output_file=os.path.join(self.tmp_dir, 'addresses.txt'), use_uncompressed=False,
+                                    start_index=0, workers=1, chunk_size=2, cache_dir=None, roster=None, revocation_column='revkey')
+        for key, value in kwargs.items():
+            setattr(config, key, value)
+        return config
+
+    def test_start_index(self):
+        config = self.get_config(start_index=5)
+        create_revocation_addresses.generate_revocation_addresses(config)
+        with open(config.output_file) as f:
+            self.assertEqual(f.read().split(), ['addr2016/1/5', 'addr2016/1/6', 'addr2016/1/7'])
+
+    def test_worker_chunks_match_serial(self):
+        config = self.get_config(number_of_addresses=5)
+        serial = list(create_revocation_addresses.iter_revocation_addresses(config, config.number_of_addresses))
+        create_revocation_addresses._init_worker('xpub', '2016/1', False)
+        chunks = [create_revocation_addresses._derive_chunk(chunk) for chunk in ([0, 1], [2, 3], [4])]
+        self.assertEqual(serial, [address for chunk in chunks for address in chunk])
+
+    def test_cache_only_derives_new_indexes(self):
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        config = self.get_config(cache_dir=cache_dir, number_of_addresses=3, start_index=2)
+        create_revocation_addresses.generate_revocation_addresses(config)
+
+        derived = []
+
+        class CountingNode(FakeNode):
+            def subkey(self, i):
+                derived.append(i)
+                return FakeNode.subkey(self, i)
+
+        create_revocation_addresses.get_key_path_node = lambda xpub, key_path: CountingNode(key_path)
+        config.start_index = 0
+        config.number_of_addresses = 6
+        create_revocation_addresses.generate_revocation_addresses(config)
+        self.assertEqual(derived, [0, 1, 5])
+
+        def fail(xpub, key_path):
+            raise AssertionError('the key was parsed for a fully cached run')
+
+        create_revocation_addresses.get_key_path_node = fail
+        create_revocation_addresses.generate_revocation_addresses(config)
+        with open(config.output_file) as f:
+            self.assertEqual(f.read().split(), ['addr2016/1/{0}'.format(i) for i in range(6)])
+        self.assertEqual(derivation_cache.lookup(cache_dir, 'xpub', '2016/1', 4), 'addr2016/1/4')
+        self.assertIsNone(derivation_cache.lookup(cache_dir, 'xpub', '2016/1', 6))
+        self.assertIsNone(derivation_cache.lookup(cache_dir, 'xpub', '2016/2', 4))
+
+    def test_add_revocation_addresses_to_roster(self):
+        roster = os.path.join(self.tmp_dir, 'roster.csv')
+        with open(roster, 'w') as f:
+            f.write('name,pubkey,identity\n"Doe, Jane",ecdsa-koblitz-pubkey:1,jane@example.org\nBob,ecdsa-koblitz-pubkey:2,bob@example.org\n')
+        config = self.get_config(roster=roster, output_file=os.path.join(self.tmp_dir, 'roster_with_rev.csv'))
+        create_revocation_addresses.add_revocation_addresses_to_roster(config)
+        with open(config.output_file) as f:
+            self.assertEqual(f.read().splitlines(), [
+                'name,pubkey,identity,revkey',
+                '"Doe, Jane",ecdsa-koblitz-pubkey:1,jane@example.org,addr2016/1/0',
+                'Bob,ecdsa-koblitz-pubkey:2,bob@example.org,addr2016/1/1'])
+
+
+    def test_blank_lines_do_not_use_addresses(self):
+        roster = os.path.join(self.tmp_dir, 'roster.csv')
+        with open(roster, 'w') as f:
+            f.write('name,pubkey,identity\nA,p,a\n\nB,q,b\n')
+        config = self.get_config(roster=roster, output_file=os.path.join(self.tmp_dir, 'roster_with_rev.csv'))
+        create_revocation_addresses.add_revocation_addresses_to_roster(config)
+        with open(config.output_file) as f:
+            self.assertEqual(f.read().splitlines(), [
+                'name,pubkey,identity,revkey', 'A,p,a,addr2016/1/0', '', 'B,q,b,addr2016/1/1'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import hashlib
+import os
+import unittest
+
+from cert_tools import email_hashing
+from cert_tools import helpers
+
+
+class Recipient:
+    def __init__(self, identity):
+        self.identity = identity
+        self.salted_identity = None
+
+
+class TestEmailHashing(unittest.TestCase):
+    def test_encode_salt(self):
+        for num in [0, 1, 61, 62, 3843, 3844, 2 ** 128 - 1]:
+            self.assertEqual(email_hashing.encode_salt(num.to_bytes(16, 'big')), helpers.encode(num))
+        for _ in range(100):
+            data = os.urandom(16)
+            self.assertEqual(email_hashing.encode_salt(data), helpers.encode(int.from_bytes(data, 'big')))
+
+    def test_iter_salted_recipients(self):
+        recipients = [Recipient('recipient{0}@example.org'.format(i)) for i in range(10)]
+        salted = list(email_hashing.iter_salted_recipients(recipients, threads=3, block_size=4))
+        self.assertEqual(salted, recipients)
+        for recipient in salted:
+            salt, identity = recipient.salted_identity
+            expected = hashlib.sha256((recipient.identity + salt).encode('utf-8')).hexdigest()
+            self.assertEqual(identity, 'sha256$' + expected)
+        self.assertEqual(len(set(recipient.salted_identity[0] for recipient in salted)), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
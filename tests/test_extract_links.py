@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cert_tools import extract_links
+
+
+class TestExtractLinks(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cert_path = os.path.join(self.tmp_dir, 'certs')
+        os.makedirs(self.cert_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_cert(self, file_name, cert):
+        with open(os.path.join(self.cert_path, file_name), 'w') as f:
+            json.dump(cert, f)
+
+    def test_extract_links_v1_2_v2_v3(self):
+        image = 'data:image/png;base64,' + 'A' * 10000
+        self.write_cert('a.json', {'assertion': {'uid': 'uid-1', 'image': image},
+                                   'recipient': {'givenName': 'Zoe', 'familyName': 'Smith'}})
+        self.write_cert('b.json', {'badge': {'image': image}, 'id': 'urn:uuid:uid-2',
+                                   'recipientProfile': {'name': 'Anna Bell'}})
+        self.write_cert('c.json', {'id': 'urn:uuid:uid-3', 'credentialSubject': {'id': 'ecdsa-koblitz-pubkey:1'}})
+        output_file = os.path.join(self.tmp_dir, 'links.txt')
+
+        extract_links.extract_links(self.cert_path, 'https://example.org/certs', output_file)
+
+        with open(output_file) as f:
+            self.assertEqual(f.read().splitlines(), [
+                'Anna Bell : https://example.org/certs/uid-2',
+                'Zoe Smith : https://example.org/certs/uid-1',
+                'ecdsa-koblitz-pubkey:1 : https://example.org/certs/uid-3'])
+
+    def test_incremental_only_reads_changed_files(self):
+        self.write_cert('a.json', {'id': 'urn:uuid:uid-1', 'recipientProfile': {'name': 'Bob'}})
+        self.write_cert('b.json', {'id': 'urn:uuid:uid-2', 'recipientProfile': {'name': 'Dan'}})
+        output_file = os.path.join(self.tmp_dir, 'links.txt')
+        manifest_file = os.path.join(self.tmp_dir, 'manifest.jsonl')
+        extract_links.extract_links_incremental(self.cert_path, 'u', output_file, manifest_file)
+
+        self.write_cert('b.json', {'id': 'urn:uuid:uid-2', 'recipientProfile': {'name': 'Dan Brown'}})
+        self.write_cert('c.json', {'id': 'urn:uuid:uid-3', 'recipientProfile': {'name': 'Carl'}})
+        read = []
+        extract_link = extract_links.extract_link
+        extract_links.extract_link = lambda cert_file: read.append(os.path.basename(cert_file)) or extract_link(cert_file)
+        try:
+            extract_links.extract_links_incremental(self.cert_path, 'u', output_file, manifest_file)
+        finally:
+            extract_links.extract_link = extract_link
+
+        self.assertEqual(sorted(read), ['b.json', 'c.json'])
+        with open(output_file) as f:
+            self.assertEqual(f.read().splitlines(), ['Bob : u/uid-1', 'Carl : u/uid-3', 'Dan Brown : u/uid-2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
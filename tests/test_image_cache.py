@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cert_tools import image_cache
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.images = []
+        for i in range(3):
+            path = os.path.join(self.tmp_dir, 'image{0}.png'.format(i))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(300))
+            self.images.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_data_uri_matches_encoding(self):
+        cache = image_cache.ImageCache()
+        data_uri = cache.get_data_uri(self.images[0])
+        self.assertEqual(data_uri, image_cache.encode_file(self.images[0]))
+        self.assertTrue(data_uri.startswith('data:image/png;base64,'))
+        self.assertIs(cache.get_data_uri(self.images[0]), data_uri)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        # room for two 300 byte images
+        cache = image_cache.ImageCache(max_bytes=900)
+        cache.get_data_uri(self.images[0])
+        cache.get_data_uri(self.images[1])
+        cache.get_data_uri(self.images[0])
+        cache.get_data_uri(self.images[2])
+        self.assertEqual([key[0] for key in cache.entries], [self.images[0], self.images[2]])
+        self.assertLessEqual(cache.size, 900)
+
+    def test_changed_image_is_reencoded(self):
+        cache = image_cache.ImageCache()
+        before = cache.get_data_uri(self.images[0])
+        with open(self.images[0], 'wb') as f:
+            f.write(b'changed')
+        self.assertNotEqual(cache.get_data_uri(self.images[0]), before)
+
+    def test_disk_cache_and_clear(self):
+        image_cache.ImageCache(cache_dir=self.cache_dir).get_data_uri(self.images[0])
+        cache = image_cache.ImageCache(cache_dir=self.cache_dir)
+        cache._write_disk = None  # must not encode again
+        self.assertEqual(cache.get_data_uri(self.images[0]), image_cache.encode_file(self.images[0]))
+
+        cache.clear()
+        self.assertEqual(cache.entries, {})
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+from cert_tools import instantiate_service
+from cert_tools import uid_strategies
+
+
+class FakeModule:
+    """Stands in for an instantiate module; blocks while the test holds the gate"""
+    gate = threading.Event()
+
+    @classmethod
+    def iter_unsigned_certificates_from_rows(cls, config, template, rows, issued_on=None, start=0):
+        cls.gate.wait(5)
+        allocator = uid_strategies.UidAllocator(config.filename_format or 'certname_identity', start=start)
+        for row in rows:
+            yield allocator.allocate(row['identity']), dict(template, name=row['name'])
+
+
+class TestInstantiateService(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'templates'))
+        self.template_file = os.path.join(self.tmp_dir, 'templates', 't.json')
+        with open(self.template_file, 'w') as f:
+            json.dump({'title': 'one'}, f)
+        config = argparse.Namespace(abs_data_dir=self.tmp_dir, template_dir='templates', template_file_name='t.json',
+                                    unsigned_certificates_dir='out', no_clobber=False, writer_threads=0, fsync=False,
+                                    serve_host='127.0.0.1', serve_port=0, max_concurrent_requests=1,
+                                    max_request_rows=10, compact_json=False, filename_format=None)
+        self.config = config
+        self.server = instantiate_service.make_server(config, FakeModule)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        FakeModule.gate.set()
+
+    def tearDown(self):
+        FakeModule.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def post(self, body):
+        request = urllib.request.Request('http://127.0.0.1:{0}/instantiate'.format(self.port),
+                                         data=json.dumps(body).encode('utf-8'))
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_instantiate_and_template_reload(self):
+        rows = [{'name': 'Ann', 'identity': 'ann'}]
+        status, response = self.post({'rows': rows})
+        self.assertEqual(status, 200)
+        self.assertEqual(response['certificates'], [{'uid': 'ann', 'certificate': {'title': 'one', 'name': 'Ann'}}])
+
+        with open(self.template_file, 'w') as f:
+            json.dump({'title': 'two!'}, f)
+        status, response = self.post({'rows': rows})
+        self.assertEqual(response['certificates'][0]['certificate']['title'], 'two!')
+        self.assertEqual(self.post({'rows': rows * 11})[0], 413)
+
+    def test_sequential_uids_run_on_across_requests(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.config.filename_format = 'sequential'
+        os.makedirs(os.path.join(self.tmp_dir, 'out'))
+        with open(os.path.join(self.tmp_dir, 'out', '6.json'), 'w') as f:
+            f.write('{}')
+        self.server = instantiate_service.make_server(self.config, FakeModule)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        rows = [{'name': 'Ann', 'identity': 'ann'}, {'name': 'Bob', 'identity': 'bob'}]
+        self.assertEqual(self.post({'rows': rows, 'persist': True})[1]['uids'], ['7', '8'])
+        self.assertEqual(self.post({'rows': rows[1:], 'persist': True})[1]['uids'], ['9'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp_dir, 'out'))), ['6.json', '7.json', '8.json', '9.json'])
+        with open(os.path.join(self.tmp_dir, 'out', '8.json')) as f:
+            self.assertEqual(json.load(f)['name'], 'Bob')
+
+    def test_rejects_requests_over_the_limit(self):
+        FakeModule.gate.clear()
+        busy = threading.Thread(target=self.post, args=({'rows': [{'name': 'Ann', 'identity': 'ann'}]},))
+        busy.start()
+        while self.server.service.counters['in_flight'] == 0:
+            time.sleep(0.01)
+        self.assertEqual(self.post({'rows': []})[0], 503)
+        FakeModule.gate.set()
+        busy.join()
+        self.assertEqual(self.server.service.get_metrics()['rejected'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
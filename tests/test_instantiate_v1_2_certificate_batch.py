@@ -0,0 +1,63 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cert_tools import instantiate_v1_2_certificate_batch
+from cert_tools import validation_helpers
+
+TEMPLATE = {'assertion': {'uid': '*|CERTUID|*', 'issuedOn': '*|DATE|*'},
+            'recipient': {'givenName': '*|FNAME|*', 'familyName': '*|LNAME|*', 'publicKey': '*|PUBKEY|*',
+                          'identity': '*|EMAIL|*'}}
+
+
+class TestInstantiateV1_2CertificateBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for directory in ('templates', 'rosters', 'out'):
+            os.makedirs(os.path.join(self.tmp_dir, directory))
+        with open(os.path.join(self.tmp_dir, 'templates', 't.json'), 'w') as f:
+            json.dump(TEMPLATE, f)
+        with open(os.path.join(self.tmp_dir, 'rosters', 'roster.csv'), 'w') as f:
+            f.write('givenName,familyName,pubkey,identity\n')
+            for i in range(3):
+                f.write('Given{0},Family{0},1Recipient{0},recipient{0}@example.org\n'.format(i))
+        self.validate_unsigned_v1_2 = validation_helpers.validate_unsigned_v1_2
+
+    def tearDown(self):
+        validation_helpers.validate_unsigned_v1_2 = self.validate_unsigned_v1_2
+        shutil.rmtree(self.tmp_dir)
+
+    def get_config(self, **kwargs):
+        config = argparse.Namespace(
+            abs_data_dir=self.tmp_dir, template_dir='templates', template_file_name='t.json',
+            roster=os.path.join('rosters', 'roster.csv'), unsigned_certificates_dir='out',
+            issuer_certs_url='https://www.issuer.org/certs/', hash_emails=False, hash_threads=1,
+            additional_per_recipient_fields=None, preflight=False, streaming=False, output_sink='directory',
+            output_archive=None, writer_threads=0, fsync=False, stats=False, stats_file=None, compact_json=False,
+            json_backend='auto')
+        for key, value in kwargs.items():
+            setattr(config, key, value)
+        return config
+
+    def fail_on_last_row(self, cert):
+        # the v1.2 schema references remote documents
+        if cert['recipient']['identity'] == 'recipient2@example.org':
+            raise Exception('invalid certificate')
+
+    def test_bad_row_leaves_no_partial_output(self):
+        validation_helpers.validate_unsigned_v1_2 = self.fail_on_last_row
+        with self.assertRaises(Exception):
+            instantiate_v1_2_certificate_batch.create_unsigned_certificates_from_roster(self.get_config())
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'out')), [])
+
+        # streaming writes each certificate as soon as it is built
+        with self.assertRaises(Exception):
+            instantiate_v1_2_certificate_batch.create_unsigned_certificates_from_roster(self.get_config(streaming=True))
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp_dir, 'out'))), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
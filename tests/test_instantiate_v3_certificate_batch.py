@@ -0,0 +1,225 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from cert_tools import checkpoint
+from cert_tools import instantiate_v3_certificate_batch
+from cert_tools import output_sinks
+
+TEMPLATE = {
+    '@context': ['https://www.w3.org/2018/credentials/v1', 'https://w3id.org/blockcerts/v3'],
+    'type': ['VerifiableCredential', 'BlockcertsCredential'],
+    'id': '*|CERTUID|*',
+    'issuer': 'https://www.issuer.org/issuer.json',
+    'issuanceDate': '*|DATE|*',
+    'credentialSubject': {'id': '*|PUBKEY|*', 'evidence': '*|EVIDENCE|*'}
+}
+PER_RECIPIENT_FIELDS = [{'path': '$.credentialSubject.evidence', 'value': '*|EVIDENCE|*', 'csv_column': 'evidence'}]
+
+
+def no_validation(cert):
+    # the v3 schema references remote documents
+    return True
+
+
+class RecordingSink(output_sinks.DirectorySink):
+    def __init__(self, events):
+        self.events = events
+
+    def write(self, uid, cert):
+        self.events.append(('write', cert['credentialSubject']['evidence']))
+
+
+class TestInstantiateV3CertificateBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for directory in ('templates', 'rosters', 'out'):
+            os.makedirs(os.path.join(self.tmp_dir, directory))
+        with open(os.path.join(self.tmp_dir, 'templates', 't.json'), 'w') as f:
+            json.dump(TEMPLATE, f)
+        self.write_roster(5)
+        self.get_certificate_validator = instantiate_v3_certificate_batch.get_certificate_validator
+        instantiate_v3_certificate_batch.get_certificate_validator = lambda config: no_validation
+
+    def tearDown(self):
+        instantiate_v3_certificate_batch.get_certificate_validator = self.get_certificate_validator
+        shutil.rmtree(self.tmp_dir)
+
+    def write_roster(self, size):
+        with open(os.path.join(self.tmp_dir, 'rosters', 'roster.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'pubkey', 'identity', 'evidence'])
+            for i in range(size):
+                writer.writerow(['Recipient {0}'.format(i), 'ecdsa-koblitz-pubkey:1Recipient{0}'.format(i),
+                                 'recipient{0}@example.org'.format(i), 'evidence {0}'.format(i)])
+
+    def get_config(self, **kwargs):
+        config = argparse.Namespace(
+            abs_data_dir=self.tmp_dir, template_dir='templates', template_file_name='t.json',
+            roster=os.path.join('rosters', 'roster.csv'), unsigned_certificates_dir='out',
+            additional_per_recipient_fields=PER_RECIPIENT_FIELDS, filename_format='sequential', no_clobber=False,
+            preflight=False, streaming=True, workers=1, chunk_size=2, fragment_validation=False,
+            full_validation_every=0, output_sink='directory', output_archive=None, writer_threads=0, fsync=False,
+            checkpoint_file=None, resume=False, stats=False, stats_file=None, compact_json=False, json_backend='auto')
+        for key, value in kwargs.items():
+            setattr(config, key, value)
+        return config
+
+    def read_certificates(self):
+        certs = {}
+        for file_name in os.listdir(os.path.join(self.tmp_dir, 'out')):
+            with open(os.path.join(self.tmp_dir, 'out', file_name)) as f:
+                certs[file_name] = json.load(f)
+        return certs
+
+    def test_streaming_writes_each_row_before_reading_the_next(self):
+        config = self.get_config()
+        events = []
+
+        def recipients():
+            for recipient in instantiate_v3_certificate_batch.get_recipients_from_roster(config):
+                events.append(('read', recipient.additional_fields['evidence']))
+                yield recipient
+
+        certs = instantiate_v3_certificate_batch.iter_unsigned_certificates_from_roster(
+            TEMPLATE, recipients(), False, PER_RECIPIENT_FIELDS, validate=no_validation)
+        output_sinks.write_unsigned_certificates(certs, RecordingSink(events))
+        expected = []
+        for i in range(5):
+            expected.extend([('read', 'evidence {0}'.format(i)), ('write', 'evidence {0}'.format(i))])
+        self.assertEqual(events, expected)
+
+    def test_streaming_batch(self):
+        instantiate_v3_certificate_batch.instantiate_batch(self.get_config())
+        certs = self.read_certificates()
+        self.assertEqual(sorted(certs), ['{0}.json'.format(i) for i in range(5)])
+        self.assertEqual(certs['3.json']['credentialSubject'],
+                         {'id': 'ecdsa-koblitz-pubkey:1Recipient3', 'evidence': 'evidence 3'})
+        self.assertEqual(certs['3.json']['id'], 'urn:uuid:3')
+
+        # the same roster without streaming gives the same certificates
+        shutil.rmtree(os.path.join(self.tmp_dir, 'out'))
+        os.makedirs(os.path.join(self.tmp_dir, 'out'))
+        instantiate_v3_certificate_batch.instantiate_batch(self.get_config(streaming=False))
+        self.assertEqual(self.read_certificates()['3.json']['credentialSubject'], certs['3.json']['credentialSubject'])
+
+    def test_skip_uids(self):
+        config = self.get_config()
+        allocator = instantiate_v3_certificate_batch.get_uid_allocator(TEMPLATE, 'sequential')
+        validated = []
+        certs = list(instantiate_v3_certificate_batch.iter_unsigned_certificates_from_roster(
+            TEMPLATE, instantiate_v3_certificate_batch.get_recipients_from_roster(config), False, PER_RECIPIENT_FIELDS,
+            validate=validated.append, skip_uids={'1', '3'}, allocator=allocator))
+        self.assertEqual([uid for uid, _ in certs], ['0', '1', '2', '3', '4'])
+        self.assertEqual([uid for uid, cert in certs if cert is None], ['1', '3'])
+        # skipped rows are not instantiated or validated
+        self.assertEqual([cert['id'] for cert in validated], ['urn:uuid:0', 'urn:uuid:2', 'urn:uuid:4'])
+
+    def test_no_clobber_keeps_existing_certificates(self):
+        for uid in ('1', '3'):
+            with open(os.path.join(self.tmp_dir, 'out', uid + '.json'), 'w') as f:
+                f.write('{}')
+        instantiate_v3_certificate_batch.instantiate_batch(self.get_config(no_clobber=True))
+        certs = self.read_certificates()
+        self.assertEqual(sorted(certs), ['{0}.json'.format(i) for i in range(5)])
+        self.assertEqual(certs['1.json'], {})
+        self.assertEqual(certs['3.json'], {})
+        self.assertEqual(certs['4.json']['credentialSubject']['evidence'], 'evidence 4')
+
+    def test_resume_does_not_build_finished_rows(self):
+        config = self.get_config(checkpoint_file='checkpoint.jsonl', resume=True)
+        roster = os.path.join(self.tmp_dir, config.roster)
+        # an interrupted run that finished the first three rows
+        with checkpoint.CheckpointJournal(os.path.join(self.tmp_dir, 'checkpoint.jsonl'), roster,
+                                          '2021-01-01T00:00:00Z') as journal:
+            for uid in ('0', '1', '2'):
+                journal.record(uid)
+            journal.commit()
+
+        built = []
+        recipient_class = instantiate_v3_certificate_batch.Recipient
+        original = vars(recipient_class)['from_row']
+        from_row = recipient_class.from_row
+
+        def recording_from_row(columns, row):
+            built.append(row[2])
+            return from_row(columns, row)
+
+        recipient_class.from_row = recording_from_row
+        try:
+            instantiate_v3_certificate_batch.instantiate_batch(config)
+        finally:
+            recipient_class.from_row = original
+        self.assertEqual(built, ['recipient3@example.org', 'recipient4@example.org'])
+        certs = self.read_certificates()
+        self.assertEqual(sorted(certs), ['3.json', '4.json'])
+        self.assertEqual(certs['3.json']['issuanceDate'], '2021-01-01T00:00:00Z')
+        self.assertEqual(certs['4.json']['credentialSubject']['evidence'], 'evidence 4')
+
+    def run_killed_after(self, config, rows):
+        """Run the batch in a child process that dies without cleaning up once ROWS certificates are built"""
+        validated = []
+
+        def validate(cert):
+            if len(validated) == rows:
+                os._exit(1)
+            validated.append(cert)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                instantiate_v3_certificate_batch.get_certificate_validator = lambda config: validate
+                instantiate_v3_certificate_batch.instantiate_batch(config)
+            finally:
+                os._exit(0)
+        self.assertEqual(os.waitpid(pid, 0)[1] >> 8, 1)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'the interrupted run is a forked process')
+    def test_resume_rewrites_uncommitted_rows_under_their_uids(self):
+        self.write_roster(250)
+        for output_sink in ('directory', 'jsonl'):
+            shutil.rmtree(os.path.join(self.tmp_dir, 'out'))
+            os.makedirs(os.path.join(self.tmp_dir, 'out'))
+            config = self.get_config(filename_format='uuid', checkpoint_file='checkpoint.jsonl', output_sink=output_sink)
+            # killed 50 rows after the first commit
+            self.run_killed_after(config, 150)
+            config.resume = True
+            instantiate_v3_certificate_batch.instantiate_batch(config)
+
+            if output_sink == 'directory':
+                certs = self.read_certificates()
+            else:
+                with open(os.path.join(self.tmp_dir, 'out', 'unsigned_certificates.jsonl')) as f:
+                    lines = [json.loads(line) for line in f]
+                self.assertEqual(len(lines), 250)
+                certs = {line['uid']: line['certificate'] for line in lines}
+            self.assertEqual(len(certs), 250, output_sink)
+            evidence = sorted(cert['credentialSubject']['evidence'] for cert in certs.values())
+            self.assertEqual(evidence, sorted('evidence {0}'.format(i) for i in range(250)))
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == 'fork', 'workers must inherit the patched validator')
+    def test_workers_match_a_single_process(self):
+        self.write_roster(11)
+        instantiate_v3_certificate_batch.instantiate_batch(self.get_config(streaming=False))
+        expected = self.read_certificates()
+        shutil.rmtree(os.path.join(self.tmp_dir, 'out'))
+        os.makedirs(os.path.join(self.tmp_dir, 'out'))
+
+        config = self.get_config(workers=3, chunk_size=2, stats_file='stats.json')
+        instantiate_v3_certificate_batch.instantiate_batch(config)
+        certs = self.read_certificates()
+        self.assertEqual(sorted(certs), sorted(expected))
+        for file_name, cert in certs.items():
+            self.assertEqual(cert['credentialSubject'], expected[file_name]['credentialSubject'])
+            self.assertEqual(cert['id'], expected[file_name]['id'])
+        # the stats of every worker chunk are merged
+        with open(os.path.join(self.tmp_dir, 'stats.json')) as f:
+            self.assertEqual(json.load(f)['rows'], 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import argparse
+import json
+import unittest
+
+from cert_tools import json_serializer
+
+CERT = {
+    'id': 'urn:uuid:bbba8553-8ec1-445f-82c9-a57251dd731c',
+    '@context': ['https://www.w3.org/2018/credentials/v1', 'https://w3id.org/blockcerts/v3'],
+    'credentialSubject': {'name': 'Zoë Ñúñez 😀', 'email': 'a/b@example.org', 'note': 'line\nbreak\t"quoted" \\ \x00'},
+    'display': {'contentMediaType': 'image/png', 'content': 'data:image/png;base64,iVBORw0KGgoAe+07e-1=='},
+    'numbers': [0, -1, 2 ** 63, 2 ** 80, 1.5, -0.0, 0.1, 1e16, 1e-7, -2.5e-300, 1e300, float('nan'), float('inf')],
+    'flags': [True, False, None],
+    'nested': {'z': {}, 'a': [], 'm': [{'y': 1, 'b': 2}]}
+}
+
+
+def installed_backends():
+    return [backend for backend in json_serializer.BACKENDS[1:]
+            if backend == 'json' or getattr(json_serializer, backend) is not None]
+
+
+class TestJsonSerializer(unittest.TestCase):
+    def test_default_layout_is_unchanged(self):
+        cert = dict(CERT, numbers=[1, 1.5])
+        self.assertEqual(json_serializer.DEFAULT.dumps(cert), json.dumps(cert))
+        self.assertEqual(json_serializer.JsonSerializer('auto').dumpb(cert), json.dumps(cert).encode('utf-8'))
+
+    def test_compact_output_is_identical_across_backends(self):
+        outputs = {backend: json_serializer.JsonSerializer(backend, compact=True).dumpb(CERT)
+                   for backend in installed_backends()}
+        expected = outputs.pop('json')
+        for backend, output in outputs.items():
+            self.assertEqual(output, expected, backend)
+        self.assertIn(b'1e16,1e-7,-2.5e-300,1e300,null,null]', expected)
+        self.assertIn('"name":"Zoë Ñúñez 😀"'.encode('utf-8'), expected)
+
+    def test_compact_output_keeps_key_order(self):
+        for backend in installed_backends():
+            text = json_serializer.JsonSerializer(backend, compact=True).dumps(CERT)
+            self.assertEqual(list(json.loads(text)), list(CERT))
+            self.assertIn('"m":[{"y":1,"b":2}]', text)
+
+    def test_strings_are_written_as_is(self):
+        strings = ['1e+16', 'NaN', '-Infinity', 'a\\"1e-07', 'data:image/png;base64,AAe+07e-1']
+        for obj in (strings, strings + [1e+16]):
+            text = json_serializer.JsonSerializer('json', compact=True).dumps(obj)
+            self.assertEqual(json.loads(text)[:len(strings)], strings)
+        self.assertTrue(text.endswith(',1e16]'))
+
+    def test_get_serializer(self):
+        self.assertIs(json_serializer.get_serializer(argparse.Namespace()), json_serializer.DEFAULT)
+        config = argparse.Namespace(compact_json=True, json_backend='json')
+        self.assertTrue(json_serializer.get_serializer(config).compact)
+
+    def test_missing_backend(self):
+        with self.assertRaises(Exception):
+            json_serializer.JsonSerializer('yaml', compact=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
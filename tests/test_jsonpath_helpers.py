@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cert_tools import jsonpath_helpers
+
+
+class TestSetField(unittest.TestCase):
+    def setUp(self):
+        jsonpath_helpers.clear_path_caches()
+
+    def test_set_existing_field(self):
+        cert = {'badge': {'name': '*|NAME|*'}}
+        jsonpath_helpers.set_field(cert, '$.badge.name', 'Certificate of Accomplishment')
+        self.assertEqual(cert, {'badge': {'name': 'Certificate of Accomplishment'}})
+
+    def test_set_new_leaf_field(self):
+        cert = {'badge': {}}
+        jsonpath_helpers.set_field(cert, '$.badge.subtitle', 'custom subtitle')
+        self.assertEqual(cert, {'badge': {'subtitle': 'custom subtitle'}})
+
+    def test_set_field_with_invalid_path_raises(self):
+        with self.assertRaises(Exception):
+            jsonpath_helpers.set_field({'badge': {}}, '$.certificate.subtitle', 'custom subtitle')
+
+    def test_set_field_with_index_uses_jsonpath_matching(self):
+        cert = {'@context': ['https://w3id.org/openbadges/v2', 'https://w3id.org/blockcerts/v2']}
+        jsonpath_helpers.set_field(cert, '$.@context[1]', 'https://w3id.org/blockcerts/v3')
+        self.assertEqual(cert['@context'][1], 'https://w3id.org/blockcerts/v3')
+
+    def test_paths_are_parsed_once(self):
+        for value in ('a', 'b', 'c'):
+            jsonpath_helpers.set_field({'evidence': ''}, '$.evidence', value)
+        info = jsonpath_helpers.parse_cache_info()
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['size'], 1)
+
+    def test_field_chain(self):
+        self.assertEqual(jsonpath_helpers.field_chain('$.badge.issuer.name'), ['badge', 'issuer', 'name'])
+        self.assertIsNone(jsonpath_helpers.field_chain('$.badge.*'))
+        self.assertIsNone(jsonpath_helpers.field_chain('$.@context[0]'))
+
+    def test_parse_matches_jsonpath_rw(self):
+        import jsonpath_rw
+        for path in ('$.badge.issuer.name', '$.@context[0]', '$.a[*].b', '$..evidence', '$.a[1:2]'):
+            self.assertEqual(str(jsonpath_helpers.parse(path)), str(jsonpath_rw.parse(path)))
+
+
+class TestParserTables(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.tmp_dir
+
+    def tearDown(self):
+        if self.cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.cache_home
+        shutil.rmtree(self.tmp_dir)
+
+    def test_tables_are_written_then_loaded(self):
+        tables_file = jsonpath_helpers.get_tables_file()
+        self.assertTrue(tables_file.startswith(self.tmp_dir))
+        expected = str(jsonpath_helpers.JsonPathParser().parse('$.badge.issuer.name'))
+        self.assertTrue(os.path.exists(tables_file))
+        self.assertEqual(str(jsonpath_helpers.JsonPathParser().parse('$.badge.issuer.name')), expected)
+
+    def test_unreadable_tables_are_rebuilt(self):
+        with open(jsonpath_helpers.get_tables_file(), 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertEqual(str(jsonpath_helpers.JsonPathParser().parse('$.a[*].b')), '$.a.[*].b')
+
+
+if __name__ == '__main__':
+    unittest.main()
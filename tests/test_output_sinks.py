@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from cert_tools import json_serializer
+from cert_tools import output_sinks
+
+CERTS = [('1234', {'id': 'urn:uuid:1234'}), ('5678', {'id': 'urn:uuid:5678'})]
+
+
+class TestOutputSinks(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def write(self, sink_type, no_clobber=False):
+        with output_sinks.get_sink(sink_type, self.output_dir, no_clobber=no_clobber) as sink:
+            output_sinks.write_unsigned_certificates(CERTS, sink)
+        return sink.location
+
+    def test_directory_sink(self):
+        self.write('directory')
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ['1234.json', '5678.json'])
+        with open(os.path.join(self.output_dir, '1234.json')) as f:
+            self.assertEqual(json.load(f), {'id': 'urn:uuid:1234'})
+
+    def test_directory_sink_no_clobber(self):
+        with open(os.path.join(self.output_dir, '1234.json'), 'w') as f:
+            f.write('{}')
+        self.write('directory', no_clobber=True)
+        with open(os.path.join(self.output_dir, '1234.json')) as f:
+            self.assertEqual(json.load(f), {})
+
+    def test_scan_existing_uids(self):
+        for file_name in ('1234.json', '5678.json', 'notes.txt'):
+            with open(os.path.join(self.output_dir, file_name), 'w') as f:
+                f.write('{}')
+        self.assertEqual(output_sinks.scan_existing_uids(self.output_dir), {'1234', '5678'})
+
+    def test_write_behind_sink(self):
+        certs = [(str(i), {'id': 'urn:uuid:{0}'.format(i)}) for i in range(500)]
+        with output_sinks.get_sink('directory', self.output_dir, writer_threads=3, fsync=True) as sink:
+            output_sinks.write_unsigned_certificates(certs, sink)
+            # everything is in place once write_unsigned_certificates returns, and no temporary file is left
+            self.assertEqual(sorted(os.listdir(self.output_dir)), sorted(uid + '.json' for uid, _ in certs))
+        with open(os.path.join(self.output_dir, '42.json')) as f:
+            self.assertEqual(json.load(f), {'id': 'urn:uuid:42'})
+
+    def test_write_behind_sink_errors(self):
+        with self.assertRaises(Exception):
+            with output_sinks.get_sink('directory', os.path.join(self.output_dir, 'missing'), writer_threads=2) as sink:
+                output_sinks.write_unsigned_certificates(CERTS, sink)
+
+    def test_jsonl_sink(self):
+        location = self.write('jsonl')
+        with open(location) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines, [{'uid': uid, 'certificate': cert} for uid, cert in CERTS])
+
+    def test_tar_sink(self):
+        location = self.write('tar')
+        with tarfile.open(location) as archive:
+            self.assertEqual(archive.getnames(), ['1234.json', '5678.json'])
+            self.assertEqual(json.loads(archive.extractfile('5678.json').read().decode('utf-8')), CERTS[1][1])
+
+    def test_zip_sink(self):
+        location = self.write('zip')
+        with zipfile.ZipFile(location) as archive:
+            self.assertEqual(archive.namelist(), ['1234.json', '5678.json'])
+            self.assertEqual(json.loads(archive.read('1234.json').decode('utf-8')), CERTS[0][1])
+
+    def test_compact_serializer(self):
+        serializer = json_serializer.JsonSerializer(compact=True)
+        certs = [('1234', {'name': 'Zoë', 'id': 'urn:uuid:1234'})]
+        for writer_threads in (0, 2):
+            with output_sinks.get_sink('directory', self.output_dir, writer_threads=writer_threads,
+                                       serializer=serializer) as sink:
+                output_sinks.write_unsigned_certificates(certs, sink)
+            with open(os.path.join(self.output_dir, '1234.json'), 'rb') as f:
+                self.assertEqual(f.read(), '{"name":"Zoë","id":"urn:uuid:1234"}'.encode('utf-8'))
+
+    def test_archive_no_clobber(self):
+        self.write('zip')
+        with self.assertRaises(Exception):
+            self.write('zip', no_clobber=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
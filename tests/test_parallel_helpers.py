@@ -0,0 +1,33 @@
+import time
+import unittest
+
+from cert_tools import parallel_helpers
+
+
+def square_chunk(chunk):
+    # early chunks finish last, so results only come back in order if the pool keeps them in order
+    time.sleep(max(0, 9 - chunk[0]) * 0.005)
+    return [i * i for i in chunk]
+
+
+def square_chunk_with_count(chunk):
+    return [i * i for i in chunk], {'rows': len(chunk)}
+
+
+class TestImapChunks(unittest.TestCase):
+    def test_chunked(self):
+        self.assertEqual(list(parallel_helpers.chunked(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_results_keep_input_order(self):
+        results = list(parallel_helpers.imap_chunks(square_chunk, iter(range(20)), 3, 3))
+        self.assertEqual(results, [i * i for i in range(20)])
+
+    def test_merge_is_called_for_every_chunk(self):
+        merged = []
+        results = list(parallel_helpers.imap_chunks(square_chunk_with_count, range(10), 2, 4, merge=merged.append))
+        self.assertEqual(results, [i * i for i in range(10)])
+        self.assertEqual(merged, [{'rows': 4}, {'rows': 4}, {'rows': 2}])
+
+
+if __name__ == '__main__':
+    unittest.main()
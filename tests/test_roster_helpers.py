@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cert_tools import instantiate_v3_certificate_batch
+from cert_tools import roster_helpers
+from cert_tools import uid_strategies
+
+
+class TestRosterHelpers(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.roster = os.path.join(self.tmp_dir, 'roster.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_recipients_from_rows(self):
+        with open(self.roster, 'w') as f:
+            f.write('evidence,name,pubkey,identity,grade\ne1,Ann,pk1,ann@example.org,A\n\ne2,Bob,pk2,bob@example.org\n')
+        recipients = [instantiate_v3_certificate_batch.Recipient.from_row(columns, row)
+                      for columns, row in roster_helpers.iter_roster_rows(self.roster,
+                                                                          instantiate_v3_certificate_batch.ROSTER_COLUMNS)]
+        self.assertEqual([(r.name, r.pubkey, r.identity) for r in recipients],
+                         [('Ann', 'pk1', 'ann@example.org'), ('Bob', 'pk2', 'bob@example.org')])
+        self.assertEqual(dict(recipients[0].additional_fields.items()), {'evidence': 'e1', 'grade': 'A'})
+        self.assertEqual(recipients[1].additional_fields['evidence'], 'e2')
+        self.assertIsNone(recipients[1].additional_fields['grade'])
+        self.assertFalse(hasattr(recipients[0], '__dict__'))
+
+    def test_start_row_skips_rows_not_lines(self):
+        with open(self.roster, 'w') as f:
+            f.write('name,pubkey,identity\nAnn,pk1,ann\n\n"B\nob",pk2,bob\nCy,pk3,cy\n')
+        rows = [row for _, row in roster_helpers.iter_roster_rows(self.roster,
+                                                                   instantiate_v3_certificate_batch.ROSTER_COLUMNS, 2)]
+        self.assertEqual(rows, [['Cy', 'pk3', 'cy']])
+
+    def test_missing_column(self):
+        with open(self.roster, 'w') as f:
+            f.write('name,identity\nAnn,ann@example.org\n')
+        with self.assertRaises(Exception):
+            list(roster_helpers.iter_roster_rows(self.roster, instantiate_v3_certificate_batch.ROSTER_COLUMNS))
+
+    def test_preflight_reports_every_problem(self):
+        with open(self.roster, 'w') as f:
+            f.write('name,pubkey,identity,grade\n'
+                    'Ann,ecdsa-koblitz-pubkey:mtr98kany9G1XYNU74pRnfBQmaCg2FZLmc,ann@example.org,A\n'
+                    'Bob,not a key,bob@example.org,B\n'
+                    'Ann,ecdsa-koblitz-pubkey:mkwntSiQmc14H65YxwckLenxY3DsEpvFbe,ann@example.org,C\n'
+                    'Cy,ecdsa-koblitz-pubkey:mkwntSiQmc14H65YxwckLenxY3DsEpvFbe\n')
+        fields = [{'path': '$.evidence', 'value': '*|EVIDENCE|*', 'csv_column': 'evidence'}]
+        problems = roster_helpers.preflight_roster(self.roster, instantiate_v3_certificate_batch.ROSTER_COLUMNS, fields,
+                                                   instantiate_v3_certificate_batch.PUBKEY_PATTERN,
+                                                   uid_strategies.normalize)
+        self.assertEqual([line for line, _ in problems], [1, 3, 4, 5])
+        self.assertIn('evidence', problems[0][1])
+        self.assertIn('line 2', problems[2][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
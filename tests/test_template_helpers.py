@@ -0,0 +1,50 @@
+import unittest
+
+from cert_tools import template_helpers
+
+TEMPLATE = {
+    'id': 'urn:uuid:*|CERTUID|*',
+    'recipient': {'identity': '*|EMAIL|*', 'hashed': False},
+    'badge': {
+        'name': 'Certificate of Accomplishment',
+        'image': 'data:image/png;base64,iVBORw0KGgo',
+        'issuer': {'name': 'University of Learning', 'image': 'data:image/png;base64,iVBORw0KGgo'}
+    }
+}
+
+
+class TestCompiledTemplate(unittest.TestCase):
+    def test_instantiate_shares_immutable_subtrees(self):
+        compiled = template_helpers.CompiledTemplate(TEMPLATE, ['$.id', '$.recipient', '$.badge.issuer.name'])
+        cert = compiled.instantiate()
+        self.assertEqual(cert, TEMPLATE)
+        self.assertIsNot(cert, TEMPLATE)
+        self.assertIsNot(cert['recipient'], TEMPLATE['recipient'])
+        self.assertIsNot(cert['badge'], TEMPLATE['badge'])
+        self.assertIsNot(cert['badge']['issuer'], TEMPLATE['badge']['issuer'])
+
+    def test_instantiate_leaves_template_untouched(self):
+        compiled = template_helpers.CompiledTemplate(TEMPLATE, ['$.id', '$.recipient', '$.badge.issuer.name'])
+        cert = compiled.instantiate()
+        cert['id'] = 'urn:uuid:1234'
+        cert['recipient']['identity'] = 'eularia@landroth.org'
+        cert['badge']['issuer']['name'] = 'Another University'
+        self.assertEqual(TEMPLATE['id'], 'urn:uuid:*|CERTUID|*')
+        self.assertEqual(TEMPLATE['recipient']['identity'], '*|EMAIL|*')
+        self.assertEqual(TEMPLATE['badge']['issuer']['name'], 'University of Learning')
+
+    def test_non_field_paths_fall_back_to_deepcopy(self):
+        compiled = template_helpers.CompiledTemplate(TEMPLATE, ['$.id', '$.badge.*'])
+        self.assertIsNone(compiled.spine)
+        cert = compiled.instantiate()
+        self.assertEqual(cert, TEMPLATE)
+        self.assertIsNot(cert['badge']['issuer'], TEMPLATE['badge']['issuer'])
+
+    def test_build_spine_keeps_outermost_deepcopy(self):
+        self.assertEqual(template_helpers.build_spine([['a', 'b'], ['a'], ['c', 'd']]),
+                         {'a': None, 'c': {'d': None}})
+        self.assertEqual(template_helpers.build_spine([['a'], ['a', 'b']]), {'a': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import hashlib
+import unittest
+
+from cert_tools import uid_strategies
+
+
+class TestUidStrategies(unittest.TestCase):
+    def test_normalize(self):
+        for text in ['ann@example.org', 'Zoë Ünal', 'a-b_c d', '', '東京 2018']:
+            self.assertEqual(uid_strategies.normalize(text), ''.join(c for c in text if c.isalnum()))
+
+    def test_certname_identity_collisions(self):
+        allocator = uid_strategies.UidAllocator('certname_identity', prefix='Badge')
+        suffix = hashlib.sha256(b'ab@example.org').hexdigest()[:8]
+        uids = [allocator.allocate(identity) for identity in ['a.b@example.org', 'ab@example.org', 'ab@example.org']]
+        self.assertEqual(uids, ['Badgeabexampleorg', 'Badgeabexampleorg-' + suffix,
+                                'Badgeabexampleorg-' + suffix + '-2'])
+        self.assertEqual(allocator.collisions, 2)
+
+    def test_deterministic_strategies(self):
+        for strategy in uid_strategies.DETERMINISTIC_STRATEGIES:
+            uids = [[uid_strategies.UidAllocator(strategy, namespace='batch').allocate(identity)
+                     for identity in ['ann@example.org', 'bob@example.org']] for _ in range(2)]
+            self.assertEqual(uids[0], uids[1])
+        self.assertNotEqual(uid_strategies.UidAllocator('uuid5_identity', namespace='one').allocate('ann@example.org'),
+                            uid_strategies.UidAllocator('uuid5_identity', namespace='two').allocate('ann@example.org'))
+
+    def test_sequential_resume(self):
+        allocator = uid_strategies.UidAllocator('sequential', start=5)
+        allocator.reserve(['3', '4'])
+        self.assertEqual([allocator.allocate('x'), allocator.allocate('y')], ['5', '6'])
+
+
+if __name__ == '__main__':
+    unittest.main()
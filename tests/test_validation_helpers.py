@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import jsonschema
+from cert_schema.errors import BlockcertValidationError
+
+from cert_tools import validation_helpers
+
+SCHEMA = {
+    '$schema': 'http://json-schema.org/draft-04/schema#',
+    'type': 'object',
+    'definitions': {
+        'Recipient': {
+            'type': 'object',
+            'properties': {'identity': {'type': 'string'}},
+            'required': ['identity']
+        }
+    },
+    'properties': {
+        'id': {'type': 'string'},
+        'recipient': {'$ref': '#/definitions/Recipient'},
+        'badge': {'type': 'object', 'required': ['name']}
+    },
+    'required': ['id', 'recipient', 'badge']
+}
+
+
+class TestFragmentValidator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.schema_file = os.path.join(self.tmp_dir, 'schema.json')
+        with open(self.schema_file, 'w') as f:
+            json.dump(SCHEMA, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def cert(self, identity):
+        return {'id': 'urn:uuid:1234', 'recipient': {'identity': identity}, 'badge': {'name': 'Certificate'}}
+
+    def test_first_certificate_is_validated_in_full(self):
+        validate = validation_helpers.FragmentValidator(self.schema_file, ['$.id', '$.recipient'])
+        broken = self.cert('eularia@landroth.org')
+        del broken['badge']['name']
+        with self.assertRaises(BlockcertValidationError):
+            validate(broken)
+
+    def test_later_certificates_only_check_per_recipient_fields(self):
+        validate = validation_helpers.FragmentValidator(self.schema_file, ['$.id', '$.recipient'])
+        self.assertTrue(validate(self.cert('eularia@landroth.org')))
+        # badge is not per-recipient, so it is not checked again
+        unchecked = self.cert('mcallister@greenborough.org')
+        del unchecked['badge']['name']
+        self.assertTrue(validate(unchecked))
+        with self.assertRaises(BlockcertValidationError):
+            validate(self.cert(5))
+
+    def test_full_validation_every(self):
+        validate = validation_helpers.FragmentValidator(self.schema_file, ['$.id', '$.recipient'],
+                                                        full_validation_every=2)
+        validate(self.cert('eularia@landroth.org'))
+        broken = self.cert('mcallister@greenborough.org')
+        del broken['badge']['name']
+        with self.assertRaises(BlockcertValidationError):
+            validate(broken)
+
+
+class TestValidateUnsignedV1_2(unittest.TestCase):
+    def test_hashed_recipient_needs_a_salt(self):
+        cert = {'recipient': {'hashed': True, 'salt': '', 'identity': 'eularia@landroth.org'}}
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            validation_helpers.validate_unsigned_v1_2(cert)
+
+
+if __name__ == '__main__':
+    unittest.main()